@@ -1,14 +1,42 @@
+'''
+Submodules are imported the first time one of their names is used (e.g. neatcrat.Plot imports matplotlib),
+so `import neatcrat` and classification-only workers do not pay for pandas or matplotlib
+`from neatcrat import *` still imports everything
+'''
+
+import importlib
+
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 
-from .agent import Agent
-from .agentfinder import AgentFinder
-from .classifier import SceneClassifier
+from . import constants
 from .constants import *
-from .data import Data
-from .debug import Debug
-from .plot import Plot
-from .scene import Scene
-from .trajectory import Trajectory
-from .utils import Angle, Coords, Numbers
\ No newline at end of file
+
+# maps each name of the package to the module it comes from
+LAZY_NAMES = {
+    'pd': 'pandas',
+    'plt': 'matplotlib.pyplot',
+    'Agent': '.agent',
+    'AgentFinder': '.agentfinder',
+    'SceneClassifier': '.classifier',
+    'Data': '.data',
+    'Debug': '.debug',
+    'Plot': '.plot',
+    'Scene': '.scene',
+    'Trajectory': '.trajectory',
+    'Angle': '.utils',
+    'Coords': '.utils',
+    'Numbers': '.utils',
+}
+
+__all__ = ['np', *(name for name in vars(constants) if not name.startswith('_')), *LAZY_NAMES]
+
+def __getattr__(name):
+    if name not in LAZY_NAMES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    module = importlib.import_module(LAZY_NAMES[name], __name__)
+    value = module if name in ('pd', 'plt') else getattr(module, name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY_NAMES))
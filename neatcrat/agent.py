@@ -3,30 +3,32 @@ Model of an agent
 '''
 
 import numpy as np
+from .constants import SECONDS_PER_FRAME
 from .utils import Angle, Coords
 
 class Agent:
-    def __init__(self, id, type, x, y, vx, vy, ax, ay, yaw, dyaw, implied):
-        self.id = id
-        self.type = type
-        self.x = x
-        self.y = y
-        self.vx = vx
-        self.vy = vy
-        self.ax = ax
-        self.ay = ay
-        self.yaw = yaw
-        self.dyaw = dyaw
-        self.implied = implied
+    '''
+    A thin view of one row ([slot, ti]) of an AgentTable
 
-        # code is the number in the end of the agent id, for "scene-000001-1", the code is "1"
-        # it is easier to identify agents with their code in plots
-        self.code = id.split('-')[-1]
+    fields (agent.x, agent.vr, agent.id, ...) are read from and written to the table
+    Agent(id, type, x, ...) makes a standalone agent backed by a table of its own
+    '''
 
-        # convert cartesian coordinates to polar coordinates and remember them
-        self.r, self.rtheta = Coords.polar(x, y)
-        self.vr, self.vtheta = Coords.polar(vx, vy)
-        self.ar, self.atheta = Coords.polar(ax, ay)
+    __slots__ = ('table', 'slot', 'ti')
+
+    def __init__(self, id, type, x, y, vx, vy, ax, ay, yaw, dyaw, implied):
+        self.table = AgentTable([id], [type], 1)
+        self.slot = 0
+        self.ti = 0
+        self.table.set(0, 0, x, y, vx, vy, ax, ay, yaw, dyaw, implied)
+
+    def view(table, slot, ti):
+        '''The agent at [slot, ti] of a table (nothing is copied)'''
+        agent = object.__new__(Agent)
+        agent.table = table
+        agent.slot = slot
+        agent.ti = ti
+        return agent
 
     def fromRawSeries(series, implied):
         return Agent(
@@ -42,7 +44,21 @@ class Agent:
             series['DYAW'],
             implied,
         )
-    
+
+    @property
+    def id(self):
+        return self.table.ids[self.slot]
+
+    @property
+    def type(self):
+        return self.table.types[self.slot]
+
+    @property
+    def code(self):
+        # code is the number in the end of the agent id, for "scene-000001-1", the code is "1"
+        # it is easier to identify agents with their code in plots
+        return self.table.codes[self.slot]
+
     def copy(self):
         return Agent(self.id, self.type, self.x, self.y, self.vx, self.vy, self.ax, self.ay, self.yaw, self.dyaw, self.implied)
 
@@ -109,8 +125,203 @@ class Agent:
 
         return 0 < front_distance < 15 and front_distance > side_distance ** 2 * 2
     
+    def __eq__(self, other):
+        return isinstance(other, Agent) and self.table is other.table and self.slot == other.slot and self.ti == other.ti
+
+    def __hash__(self):
+        return hash((id(self.table), self.slot, self.ti))
+
     def __str__(self):
         return f"[ Agent({self.code}) at ({self.x:.2f}, {self.y:.2f}) ]"
     
+    def __repr__(self):
+        return self.__str__()
+
+
+def _field_property(field):
+    # reads and writes one field of the agent's row in its table
+    def get(self):
+        return getattr(self.table, field)[self.slot, self.ti]
+    def set(self, value):
+        getattr(self.table, field)[self.slot, self.ti] = value
+    return property(get, set)
+
+for _field in ['x', 'y', 'vx', 'vy', 'ax', 'ay', 'yaw', 'dyaw', 'r', 'rtheta', 'vr', 'vtheta', 'ar', 'atheta', 'implied']:
+    setattr(Agent, _field, _field_property(_field))
+
+
+class AgentTable:
+    '''
+    Structure of arrays holding many agents
+
+    every field is one (slots x frames) array, a slot holds the agents of one trajectory and a frame is a timestamp index
+    "valid" marks the rows that hold an agent, "implied" marks valid rows that were not observed (extrapolated or interpolated)
+    '''
+
+    # numeric fields of an agent
+    FIELDS = ['x', 'y', 'vx', 'vy', 'ax', 'ay', 'yaw', 'dyaw']
+
+    # polar forms of (x, y), (vx, vy) and (ax, ay)
+    # they are computed for the whole table at once the first time one of them is used, and are not stored before that
+    POLAR_FIELDS = ['r', 'rtheta', 'vr', 'vtheta', 'ar', 'atheta']
+
+    def __init__(self, ids, types, n_frames):
+        # per slot
+        self.ids: list[str] = list(ids)
+        self.types: list[str] = list(types)
+        self.codes: list[str] = [id.split('-')[-1] for id in self.ids]
+
+        # per slot and frame
+        shape = (len(self.ids), n_frames)
+        for field in AgentTable.FIELDS:
+            setattr(self, field, np.zeros(shape))
+        self.valid = np.zeros(shape, dtype=bool)
+        self.implied = np.zeros(shape, dtype=bool)
+
+        self.polar = None
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set, i.e. polar fields
+        if name in AgentTable.POLAR_FIELDS:
+            if self.polar is None:
+                self.update_polar()
+            return self.polar[name]
+        raise AttributeError(name)
+
+    def fromRawColumns(columns, tis, n_frames):
+        '''
+        Makes a table from raw csv columns (one row per agent at a timestamp index "tis")
+
+        slots are ordered by the first appearance of each agent id, all rows are converted at once
+        '''
+        track_ids = np.asarray(columns['TRACK_ID'])
+        object_types = np.asarray(columns['OBJECT_TYPE'])
+
+        # rank agent ids by their first appearance
+        _, first_rows, id_indices = np.unique(track_ids, return_index=True, return_inverse=True)
+        first_rows_in_order = np.sort(first_rows)
+        slots = np.argsort(np.argsort(first_rows, kind='stable'), kind='stable')[id_indices]
+
+        table = AgentTable(track_ids[first_rows_in_order].tolist(), object_types[first_rows_in_order].tolist(), n_frames)
+        table.x[slots, tis] = columns['X']
+        table.y[slots, tis] = columns['Y']
+        table.vx[slots, tis] = columns['V_X']
+        table.vy[slots, tis] = columns['V_Y']
+        table.ax[slots, tis] = columns['A_X']
+        table.ay[slots, tis] = columns['A_Y']
+        table.yaw[slots, tis] = Angle.normalize(np.asarray(columns['YAW'], dtype=float) + 90)
+        table.dyaw[slots, tis] = columns['DYAW']
+        table.valid[slots, tis] = True
+        return table
+
+    def set(self, slot, ti, x, y, vx, vy, ax, ay, yaw, dyaw, implied):
+        '''Writes one agent into [slot, ti]'''
+        for field, value in zip(AgentTable.FIELDS, [x, y, vx, vy, ax, ay, yaw, dyaw]):
+            getattr(self, field)[slot, ti] = value
+        self.valid[slot, ti] = True
+        self.implied[slot, ti] = implied
+
+        # polar fields are recomputed on their next use
+        self.polar = None
+
+    def interpolate_gaps(self, slots=None):
+        '''
+        Fills every frame that a slot misses between two of its agents, for all slots (or the given ones) at once, and marks them implied
+
+        x and y follow a cubic Hermite curve through the agents around the gap (with their velocities as tangents),
+        yaw turns the short way from one to the other, and the other fields change linearly
+        returns the number of filled rows
+        '''
+        n_frames = self.valid.shape[1]
+        frames = np.arange(n_frames)
+
+        # nearest valid frame at or before and at or after every frame of every slot (-1 or n_frames if there is none)
+        before = np.maximum.accumulate(np.where(self.valid, frames, -1), axis=1)
+        after = np.minimum.accumulate(np.where(self.valid, frames, n_frames)[:, ::-1], axis=1)[:, ::-1]
+
+        gaps = ~self.valid & (before >= 0) & (after < n_frames)
+        if slots is not None:
+            selected = np.zeros(len(self.ids), dtype=bool)
+            selected[slots] = True
+            gaps &= selected[:, None]
+
+        slots, tis = np.nonzero(gaps)
+        if len(slots) == 0:
+            return 0
+
+        # agents around each gap, and how far into the gap each missing frame is (0 < s < 1)
+        prev_tis, next_tis = before[slots, tis], after[slots, tis]
+        s = (tis - prev_tis) / (next_tis - prev_tis)
+        duration = (next_tis - prev_tis) * SECONDS_PER_FRAME
+
+        def linear(values):
+            return values[slots, prev_tis] + (values[slots, next_tis] - values[slots, prev_tis]) * s
+
+        def hermite(values, velocities):
+            s2, s3 = s ** 2, s ** 3
+            return (
+                (2 * s3 - 3 * s2 + 1) * values[slots, prev_tis] + (s3 - 2 * s2 + s) * duration * velocities[slots, prev_tis]
+                + (3 * s2 - 2 * s3) * values[slots, next_tis] + (s3 - s2) * duration * velocities[slots, next_tis]
+            )
+
+        yaw_turn = Angle.normalize(self.yaw[slots, next_tis] - self.yaw[slots, prev_tis])
+        self.x[slots, tis] = hermite(self.x, self.vx)
+        self.y[slots, tis] = hermite(self.y, self.vy)
+        self.yaw[slots, tis] = Angle.normalize(self.yaw[slots, prev_tis] + yaw_turn * s)
+        for field in ['vx', 'vy', 'ax', 'ay', 'dyaw']:
+            getattr(self, field)[slots, tis] = linear(getattr(self, field))
+        self.valid[slots, tis] = True
+        self.implied[slots, tis] = True
+
+        # polar fields that were computed are only updated where rows were filled
+        if self.polar is not None:
+            self.update_polar(slots, tis)
+
+        return len(slots)
+
+    def resized(self, n_frames):
+        '''Copy of the table with n_frames frames (frames are cut at the end or empty ones are added)'''
+        table = AgentTable(self.ids, self.types, n_frames)
+        n = min(n_frames, self.valid.shape[1])
+        for field in [*AgentTable.FIELDS, 'valid', 'implied']:
+            getattr(table, field)[:, :n] = getattr(self, field)[:, :n]
+        return table
+
+    def taken(self, slots):
+        '''Copy of the table with only the given slots (in that order)'''
+        table = AgentTable([self.ids[slot] for slot in slots], [self.types[slot] for slot in slots], self.valid.shape[1])
+        for field in [*AgentTable.FIELDS, 'valid', 'implied']:
+            setattr(table, field, getattr(self, field)[slots])
+        return table
+
+    def update_polar(self, slots=None, tis=None):
+        '''Converts all (x, y), (vx, vy), (ax, ay) to polar coordinates at once, or only those of the rows [slots, tis]'''
+        if slots is None or self.polar is None:
+            self.polar = dict(zip(AgentTable.POLAR_FIELDS, [*Coords.polar(self.x, self.y), *Coords.polar(self.vx, self.vy), *Coords.polar(self.ax, self.ay)]))
+            return
+        for i, (xs, ys) in enumerate([(self.x, self.y), (self.vx, self.vy), (self.ax, self.ay)]):
+            distances, angles = Coords.polar(xs[slots, tis], ys[slots, tis])
+            self.polar[AgentTable.POLAR_FIELDS[2*i]][slots, tis] = distances
+            self.polar[AgentTable.POLAR_FIELDS[2*i + 1]][slots, tis] = angles
+
+    def agent(self, slot, ti) -> Agent:
+        return Agent.view(self, slot, ti)
+
+    def slots_at(self, ti, include_implied=False) -> np.ndarray:
+        '''Slots that hold an agent at timestamp index ti'''
+        mask = self.valid[:, ti] if include_implied else self.valid[:, ti] & ~self.implied[:, ti]
+        return np.flatnonzero(mask)
+
+    @property
+    def nbytes(self):
+        polar = self.polar.values() if self.polar is not None else []
+        return sum(array.nbytes for array in [*(getattr(self, field) for field in AgentTable.FIELDS), self.valid, self.implied, *polar])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __str__(self):
+        return f'AgentTable({len(self.ids)} slots x {self.valid.shape[1]} frames)'
+
     def __repr__(self):
         return self.__str__()
\ No newline at end of file
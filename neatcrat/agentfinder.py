@@ -2,14 +2,25 @@
 Finds specific agents in a scene
 '''
 
+import numpy as np
+
+from .cache import FeatureCache
 from .constants import SCENE_LENGTH
+from .instrument import Instruments
+from .relations import Relations
 from .scene import Scene
+from .spatial import SpatialIndex
+from .trajectory import Trajectory
+from .utils import Angle
 
 class AgentFinder:
     TURNING_EXTRAPOLATION_RANGE = 10
 
-    def __init__(self, scene: Scene):
+    def __init__(self, scene: Scene, cache: FeatureCache = None):
         self.scene = scene
+
+        # front tracks are read from (and written to) the cache if there is one
+        self.cache = cache
     
     def get_ego(self, ti):
         return self.scene.trajectories['ego'][ti]
@@ -17,47 +28,191 @@ class AgentFinder:
     def get_front(self, ti, max_extrapolation=40, use_direct_front=True):
         '''Find the nearest agent on the way of the ego'''
 
-        snapshot = self.scene.snapshot(ti)
+        # for a given scene, move ego across the time dimension: all future ego anchors at once
+        anchor_xs, anchor_ys, anchor_yaws = self.scene.trajectories['ego'].poses(ti + 1, ti + max_extrapolation)
 
-        ego_ti = ti + 1
+        i = self.find_front(ti, anchor_xs, anchor_ys, anchor_yaws, use_direct_front)
+        return None if i < 0 else self.scene.snapshot(ti)[i]
 
-        # for a given scene, move ego across the time dimension
-        while ego_ti < ti + max_extrapolation:
+    def find_front(self, ti, anchor_xs, anchor_ys, anchor_yaws, use_direct_front=True):
+        '''Position (in snapshot(ti)) of the front agent given the future ego anchors, -1 if there is none'''
+        ego = self.get_ego(ti)
+        table = self.scene.table
+        slots = table.slots_at(ti)
+        not_ego = slots != self.scene.trajectories['ego'].slot
+        return AgentFinder.front_of(table.x[slots, ti], table.y[slots, ti], not_ego, ego.x, ego.y, ego.yaw, anchor_xs, anchor_ys, anchor_yaws, use_direct_front, self.scene.snapshot_index(ti))
 
-            # get ego at this future timestamp
-            ego_anchor = self.get_ego(ego_ti)
+    def front_of(xs, ys, not_ego, ego_x, ego_y, ego_yaw, anchor_xs, anchor_ys, anchor_yaws, use_direct_front=True, index: SpatialIndex = None):
+        '''
+        Position (in xs, ys) of the front agent of ego among some agents, -1 if there is none
 
-            # ignore agents far from ego
-            close_agents = [agent for agent in snapshot if \
-                agent.distance_to(ego_anchor) < 5 \
-                and agent.id != 'ego' \
-            ]
+        "not_ego" masks the agents that are not ego, (ego_x, ego_y, ego_yaw) is the current ego and anchor_* are its future poses
+        "index" is a spatial index of the agents (None searches all of them, which is cheaper for small snapshots)
+        '''
+        # only agents in the very near box of some anchor can be on track, the index finds them from the grid cells around the anchors
+        candidates = index.within_box(anchor_xs, anchor_ys, anchor_yaws, 3.5, 1.5) if index is not None else np.arange(len(xs))
+        candidates = candidates[not_ego[candidates]]
 
-            # sort snapshot from nearest to farthest
-            close_agents.sort(key=lambda agent: agent.distance_to(ego_anchor))
+        if len(candidates) > 0:
+            candidate_xs, candidate_ys = xs[candidates], ys[candidates]
+            anchor_xs, anchor_ys, anchor_yaws = anchor_xs[:, None], anchor_ys[:, None], anchor_yaws[:, None]
 
-            # move from nearest to farthest agent
-            for agent in close_agents:
+            # distances between every ego anchor (one per row) and every candidate, and which candidates are close to and on track of which anchor
+            # TODO?: change to agent.is_in_track_of(ego_anchor, next_ego_anchor): get angle, use angle threshold
+            distances = Relations.distances(candidate_xs, candidate_ys, anchor_xs, anchor_ys)
+            on_track = (distances < 5) & Relations.very_near(candidate_xs, candidate_ys, anchor_xs, anchor_ys, anchor_yaws)
 
-                # return the first agent that's on track
-                # TODO?: change to agent.is_in_track_of(ego_anchor, next_ego_anchor): get angle, use angle threshold
-                if agent.is_very_near(ego_anchor):
-                    return agent
-            
-            ego_ti += 1
+            # return the nearest agent that's on track of the first anchor that has one
+            anchors_with_agents = on_track.any(axis=1)
+            if anchors_with_agents.any():
+                anchor = np.argmax(anchors_with_agents)
+                on_track_candidates = np.flatnonzero(on_track[anchor])
+                if Instruments.enabled:
+                    Instruments.count('front searches')
+                    Instruments.count('anchors walked', int(anchor) + 1)
+                return int(candidates[on_track_candidates[np.argmin(distances[anchor, on_track_candidates])]])
         
-        # if nothing is found, find an agent in the direct front
+        if Instruments.enabled:
+            Instruments.count('front searches')
+            Instruments.count('anchors walked', len(anchor_xs))
+
+        # if nothing is found, find the nearest agent in the direct front
         if use_direct_front:
-            ego = self.get_ego(ti)
-            snapshot.sort(key=lambda agent: agent.front_distance_relative_to(ego))
-            for agent in snapshot:
-                if agent.is_directly_in_front_of(ego):
-                    return agent
+            # agents directly in front are less than 15 ahead and less than sqrt(15 / 2) to the side, so within 16 of ego
+            candidates = index.within_radius(ego_x, ego_y, 16) if index is not None else np.arange(len(xs))
+            candidate_xs, candidate_ys = xs[candidates], ys[candidates]
+            front_distances, _ = Relations.front_and_side_distances(candidate_xs, candidate_ys, ego_x, ego_y, ego_yaw)
+            directly_in_front = Relations.directly_in_front(candidate_xs, candidate_ys, ego_x, ego_y, ego_yaw)
+            if directly_in_front.any():
+                directly_in_front_candidates = np.flatnonzero(directly_in_front)
+                return int(candidates[directly_in_front_candidates[np.argmin(front_distances[directly_in_front_candidates])]])
         
-        return None
+        return -1
     
     # used for classifying gostraight, turnleft, and turnright
     # high coupling for syntactic sugar
     def get_turning_front(self, ti):
         return self.get_front(ti, max_extrapolation=self.TURNING_EXTRAPOLATION_RANGE, use_direct_front=False)
 
+    def front_track(self, max_extrapolation=40, use_direct_front=True):
+        '''
+        Front agent of every frame of the scene, computed at once (same agents as get_front) and cached on the scene
+
+        returns (slots, distances): for each timestamp index, the table slot of the front agent (-1 if there is none)
+        and its distance to ego (nan if there is none)
+        '''
+
+        key = (max_extrapolation, use_direct_front)
+        if key in self.scene.front_tracks:
+            return self.scene.front_tracks[key]
+
+        # the extrapolation model decides the ego anchors, and agents left out of the scene cannot be fronts, so they are part of the cache key
+        parameters = (max_extrapolation, use_direct_front, Trajectory.EXTRAPOLATION_RANGE, Trajectory.MOMENTUM_FACTOR, self.scene.max_distance)
+        cached = self.cache.get(self.scene, parameters) if self.cache is not None else None
+        if cached is not None:
+            slots, distances, dvs = cached
+            self.scene.front_tracks[key] = slots, distances
+            self.scene.front_dvs[key] = dvs
+            return slots, distances
+
+        table = self.scene.table
+        n = SCENE_LENGTH
+        window = max(max_extrapolation - 1, 0)
+
+        # ego poses from the first frame to the last anchor of the last frame (extrapolated where needed)
+        ego_xs, ego_ys, ego_yaws = self.scene.trajectories['ego'].poses(0, n + window)
+
+        # anchors of frame ti are ego at ti+1 ... ti+window, neighbouring frames share all but one of their anchors
+        # so every frame's window is a view into the same pose arrays, as (frames x anchors)
+        anchor_xs, anchor_ys, anchor_yaws = [np.lib.stride_tricks.sliding_window_view(poses[1:], window)[:n] for poses in [ego_xs, ego_ys, ego_yaws]]
+
+        # agents of every snapshot as (frames x slots) arrays
+        xs, ys = table.x[:, :n].T, table.y[:, :n].T
+        in_snapshot = (table.valid[:, :n] & ~table.implied[:, :n]).T
+        not_ego = np.arange(len(table)) != self.scene.trajectories['ego'].slot
+
+        # agents that can be on track are within 4 of some anchor, so inside the bounding box of the frame's anchors grown by 4
+        # in large snapshots, only those the spatial index finds in the very near box of some anchor
+        candidates = in_snapshot & not_ego
+        if window > 0:
+            candidates &= (anchor_xs.min(axis=1)[:, None] - 4 <= xs) & (xs <= anchor_xs.max(axis=1)[:, None] + 4)
+            candidates &= (anchor_ys.min(axis=1)[:, None] - 4 <= ys) & (ys <= anchor_ys.max(axis=1)[:, None] + 4)
+        for ti in np.flatnonzero(in_snapshot.sum(axis=1) >= SpatialIndex.MIN_AGENTS).tolist():
+            near = np.zeros(len(table), dtype=bool)
+            near[table.slots_at(ti)[self.scene.snapshot_index(ti).within_box(anchor_xs[ti], anchor_ys[ti], anchor_yaws[ti], 3.5, 1.5)]] = True
+            candidates[ti] &= near
+
+        # distances between every anchor and every candidate slot of its frame, as (frames x anchors x candidate slots)
+        columns = np.flatnonzero(candidates.any(axis=0))
+        candidate_xs, candidate_ys = xs[:, None, columns], ys[:, None, columns]
+        anchor_x, anchor_y, anchor_yaw = anchor_xs[:, :, None], anchor_ys[:, :, None], anchor_yaws[:, :, None]
+        # same as (distances < 5) & Relations.very_near(...), whose distance pruning (at most 4) is the stricter one
+        distances = Relations.distances(candidate_xs, candidate_ys, anchor_x, anchor_y)
+        front, side = Relations.front_and_side_distances(candidate_xs, candidate_ys, anchor_x, anchor_y, anchor_yaw)
+        on_track = (distances <= 4) & (np.abs(front) < 3.5) & (np.abs(side) < 1.5) & candidates[:, None, columns]
+
+        # for each frame, the nearest agent that's on track of the first anchor that has one
+        frames = np.arange(n)
+        slots = np.full(n, -1)
+        anchors_with_agents = on_track.any(axis=2)
+        found = anchors_with_agents.any(axis=1)
+        first_anchors = np.argmax(anchors_with_agents, axis=1) if window > 0 else np.zeros(n, dtype=int)
+        if found.any():
+            candidate_distances = np.where(on_track[frames, first_anchors], distances[frames, first_anchors], np.inf)
+            slots[found] = columns[np.argmin(candidate_distances[found], axis=1)]
+        if Instruments.enabled:
+            Instruments.count('front searches', n)
+            Instruments.count('anchors walked', int(np.where(found, first_anchors + 1, window).sum()))
+
+        # if nothing is found, find the nearest agent in the direct front
+        if use_direct_front:
+            ego_x, ego_y, ego_yaw = ego_xs[:n, None], ego_ys[:n, None], ego_yaws[:n, None]
+            front_distances, _ = Relations.front_and_side_distances(xs, ys, ego_x, ego_y, ego_yaw)
+            directly_in_front = in_snapshot & Relations.directly_in_front(xs, ys, ego_x, ego_y, ego_yaw)
+            direct_slots = np.argmin(np.where(directly_in_front, front_distances, np.inf), axis=1)
+            slots = np.where(~found & directly_in_front.any(axis=1), direct_slots, slots)
+
+        # distance from each front agent to ego
+        has_front = slots >= 0
+        distances = np.full(n, np.nan)
+        distances[has_front] = Relations.distances(xs[frames, slots][has_front], ys[frames, slots][has_front], ego_xs[:n][has_front], ego_ys[:n][has_front])
+
+        self.scene.front_tracks[key] = slots, distances
+        if self.cache is not None:
+            self.scene.front_dvs[key] = self.relative_velocities(slots)
+            self.cache.put(self.scene, parameters, slots, distances, self.scene.front_dvs[key])
+        return slots, distances
+
+    def front_dvs(self, max_extrapolation=40, use_direct_front=True):
+        '''Velocity of the front agent of every frame relative to ego (nan if there is none), read from the cache if it is there'''
+        key = (max_extrapolation, use_direct_front)
+        slots, _ = self.front_track(max_extrapolation, use_direct_front)
+        if key not in self.scene.front_dvs:
+            self.scene.front_dvs[key] = self.relative_velocities(slots)
+        return self.scene.front_dvs[key]
+
+    def relative_velocities(self, slots):
+        '''
+        Velocity of the agent in each slot relative to ego (nan where the slot is -1), one slot per frame
+
+        both velocities are projected on the ego's heading, same as front.front_velocity_relative_to(ego) - ego.front_velocity_relative_to(ego)
+        '''
+        table = self.scene.table
+        frames = np.arange(len(slots))
+        ego_slot = self.scene.trajectories['ego'].slot
+        has_agent = slots >= 0
+        slots = np.where(has_agent, slots, ego_slot)
+
+        ego_yaws = table.yaw[ego_slot, frames]
+        ego_v = table.vr[ego_slot, frames] * Angle.cos(Angle.normalize(table.vtheta[ego_slot, frames] - ego_yaws))
+        agent_v = table.vr[slots, frames] * Angle.cos(Angle.normalize(table.vtheta[slots, frames] - ego_yaws))
+        return np.where(has_agent, agent_v - ego_v, np.nan)
+
+    def get_fronts(self, tis, max_extrapolation=40, use_direct_front=True):
+        '''get_front for many timestamp indices, read from the front track'''
+        slots, _ = self.front_track(max_extrapolation, use_direct_front)
+        return [None if slots[ti] < 0 else self.scene.table.agent(int(slots[ti]), ti) for ti in tis]
+
+    def get_turning_fronts(self, tis):
+        return self.get_fronts(tis, max_extrapolation=self.TURNING_EXTRAPOLATION_RANGE, use_direct_front=False)
+
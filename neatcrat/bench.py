@@ -0,0 +1,217 @@
+'''
+Benchmarks of every stage of the pipeline on fixed subsets of the dataset
+
+Every stage is a setup (not measured) and a run (measured) over the scenes of a subset:
+load (Data), scene (Scene.from_data), front (AgentFinder.get_front of every frame), extrapolation (ego trajectory
+extrapolated EXTRAPOLATION_HORIZON frames past the scene), classify (SceneClassifier.classify_scene), and plot (rendering
+every PLOT_FRAME_STEP-th frame with Plot into an off-screen canvas)
+
+A stage is timed REPEATS times (the best time is kept), then run once more under tracemalloc for its peak memory
+Front tracks are not read from or written to the on-disk cache, so the finder itself is measured
+
+Run `python -m neatcrat.bench --save bench_baseline.json` to store a baseline,
+and `python -m neatcrat.bench --compare bench_baseline.json` to fail (exit code 1) on a stage that got slower or bigger
+
+With pytest-benchmark, a stage is measured as
+    setup, run = Benchmark.prepare('classify', Benchmark.subset('small'))
+    benchmark.pedantic(run, setup=lambda: ((setup(),), {}), rounds=5)
+'''
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from .agentfinder import AgentFinder
+from .classifier import SceneClassifier
+from .constants import SCENE_LENGTH
+from .data import Data
+from .packed import PackedDataset
+from .scene import Scene
+from .trajectory import Trajectory
+
+class Benchmark:
+
+    # number of scenes in each subset, the scenes are spread evenly over the dataset (in file number order)
+    SUBSETS = {'small': 10, 'medium': 50, 'large': 200}
+
+    # stages in the order they are run
+    STAGES = ['load', 'scene', 'front', 'extrapolation', 'classify', 'plot']
+
+    # how many times each stage is timed
+    REPEATS = 3
+
+    # how far past the end of the scene the ego trajectory is extrapolated
+    EXTRAPOLATION_HORIZON = 400
+
+    # canvas of the plot stage (same as the example in plot.py), and the frames it renders (a frame takes ~0.1s)
+    PLOT_LIMITS = (-30, 30, -50, 300)
+    PLOT_FRAME_STEP = 10
+
+    # a stage regresses if it gets slower (or takes more memory) than the baseline by more than these fractions
+    # (the small subset takes a fraction of a second per stage, its times vary by ~20% from run to run)
+    TIME_TOLERANCE = 0.3
+    MEMORY_TOLERANCE = 0.2
+
+    def subset(name, dataset_path=None) -> list[str]:
+        '''File names of a subset, the same ones every time for the same dataset'''
+        file_names = sorted(Data.file_names(dataset_path)[2], key=lambda file_name: int(file_name.split('.')[0]))
+        size = min(Benchmark.SUBSETS[name], len(file_names))
+        return [file_names[i * len(file_names) // size] for i in range(size)]
+
+    ''' stages '''
+
+    def prepare(stage, file_names, dataset_path=None):
+        '''
+        (setup, run) of a stage, run(setup()) does the measured work
+
+        setup builds fresh inputs every time, so nothing that run caches (e.g. Scene.front_tracks) is reused
+        '''
+        # the packed dataset is loaded once, its loading is not part of any stage
+        PackedDataset.load(Data.root if dataset_path is None else dataset_path)
+
+        def datas():
+            return [Data(file_name, dataset_path) for file_name in file_names]
+
+        def scenes():
+            scenes = [Scene.from_data(data) for data in datas()]
+            # scenes without a data file are never cached
+            for scene in scenes:
+                scene.file_path = None
+            return scenes
+
+        def load(_):
+            return datas()
+
+        def build(datas):
+            return [Scene.from_data(data) for data in datas]
+
+        def find_fronts(scenes):
+            for scene in scenes:
+                finder = AgentFinder(scene)
+                for ti in range(SCENE_LENGTH):
+                    finder.get_front(ti)
+
+        def ego_trajectories():
+            return [Trajectory.fromTable(scene.table, scene.trajectories['ego'].slot) for scene in scenes()]
+
+        def extrapolate(trajectories):
+            for trajectory in trajectories:
+                for ti in range(SCENE_LENGTH, SCENE_LENGTH + Benchmark.EXTRAPOLATION_HORIZON):
+                    trajectory[ti]
+
+        def classify(scenes):
+            return [SceneClassifier(scene).classify_scene() for scene in scenes]
+
+        def plot_setup():
+            # render off-screen, without a window
+            import matplotlib.pyplot as plt
+            plt.switch_backend('Agg')
+
+            from .plot import Plot
+            return Plot(*Benchmark.PLOT_LIMITS), scenes()
+
+        def plot(inputs):
+            import matplotlib.pyplot as plt
+
+            p, scenes = inputs
+            for scene in scenes:
+                for ti in range(0, SCENE_LENGTH, Benchmark.PLOT_FRAME_STEP):
+                    p.redraw_canvas()
+                    p.draw_visible_snapshot(scene, ti)
+                    p.fig.canvas.draw()
+            plt.close(p.fig)
+
+        return {
+            'load': (lambda: None, load),
+            'scene': (datas, build),
+            'front': (scenes, find_fronts),
+            'extrapolation': (ego_trajectories, extrapolate),
+            'classify': (scenes, classify),
+            'plot': (plot_setup, plot),
+        }[stage]
+
+    def measure(stage, file_names, dataset_path=None, repeats=REPEATS):
+        '''Best time and peak memory of a stage'''
+        setup, run = Benchmark.prepare(stage, file_names, dataset_path)
+
+        seconds = []
+        for _ in range(repeats):
+            inputs = setup()
+            start = time.perf_counter()
+            run(inputs)
+            seconds.append(time.perf_counter() - start)
+
+        # memory is measured in a run of its own, tracemalloc slows everything down
+        inputs = setup()
+        tracemalloc.start()
+        try:
+            run(inputs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {'scenes': len(file_names), 'seconds': min(seconds), 'ms_per_scene': min(seconds) / len(file_names) * 1000, 'peak_bytes': peak}
+
+    def run(stages=STAGES, subset='small', repeats=REPEATS, dataset_path=None, report=sys.stderr):
+        '''Maps each stage to its measurements, on the scenes of a subset'''
+        file_names = Benchmark.subset(subset, dataset_path)
+        results = {'subset': subset, 'stages': {}}
+        for stage in stages:
+            results['stages'][stage] = Benchmark.measure(stage, file_names, dataset_path, repeats)
+            if report is not None:
+                print(Benchmark.line(stage, results['stages'][stage]), file=report)
+        return results
+
+    ''' baselines '''
+
+    def compare(results, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE) -> list[str]:
+        '''Regressions of results against a baseline of the same subset (empty if there are none)'''
+        if results['subset'] != baseline['subset']:
+            raise ValueError(f'Cannot compare subset {results["subset"]} to a baseline of subset {baseline["subset"]}')
+
+        regressions = []
+        for stage, measured in results['stages'].items():
+            if stage not in baseline['stages']:
+                continue
+            expected = baseline['stages'][stage]
+            if measured['seconds'] > expected['seconds'] * (1 + time_tolerance):
+                regressions.append(f'{stage}: {measured["seconds"]:.3f}s, baseline {expected["seconds"]:.3f}s')
+            if measured['peak_bytes'] > expected['peak_bytes'] * (1 + memory_tolerance):
+                regressions.append(f'{stage}: peak {measured["peak_bytes"] / 2**20:.1f}MB, baseline {expected["peak_bytes"] / 2**20:.1f}MB')
+        return regressions
+
+    def line(stage, measured):
+        return f'{stage:<14}{measured["seconds"]:>9.3f}s{measured["ms_per_scene"]:>10.2f} ms/scene{measured["peak_bytes"] / 2**20:>9.1f} MB peak'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m neatcrat.bench', description='Benchmarks every stage of the pipeline')
+    parser.add_argument('stages', nargs='*', help=f'stages to run, of {", ".join(Benchmark.STAGES)} (all of them by default)')
+    parser.add_argument('--subset', default='small', choices=list(Benchmark.SUBSETS), help='scenes to run the stages on')
+    parser.add_argument('--repeats', type=int, default=Benchmark.REPEATS, help='times each stage is timed (the best time is kept)')
+    parser.add_argument('--save', help='json file the results are stored in, as a baseline')
+    parser.add_argument('--compare', help='baseline json file, exits with 1 if a stage regressed')
+    parser.add_argument('--dataset', default=None, help='path that holds the dataset directory')
+    args = parser.parse_args()
+    for stage in args.stages:
+        if stage not in Benchmark.STAGES:
+            parser.error(f'unknown stage {stage}')
+
+    results = Benchmark.run(args.stages or Benchmark.STAGES, args.subset, args.repeats, args.dataset)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        try:
+            regressions = Benchmark.compare(results, baseline)
+        except ValueError as e:
+            parser.error(str(e))
+        for regression in regressions:
+            print(f'regression: {regression}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
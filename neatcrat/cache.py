@@ -0,0 +1,182 @@
+'''
+On-disk cache of front agent tracks (see AgentFinder.front_track)
+
+The front agents of a scene only depend on its data file, the finder parameters and the code that finds them,
+so FeatureCache keeps them between runs: one small binary file per (scene file hash, finder parameters, code version),
+holding the front agent, its distance to ego and its velocity relative to ego of every frame
+The front agent is stored as its slot in the scene's AgentTable (-1 if there is none), not as its TRACK_ID: a scene built
+from the same data file has the same slots, and table.ids[slot] gives the id back
+
+Caching is opt-in: AgentFinder(scene, cache=FeatureCache.shared(dataset_path)) (or SceneClassifier, SceneFeatures, SceneVideo
+with a cache) reads a front track from the cache before computing it, and stores it after
+The batch tools (run, sweep, video export) pass the cache of the dataset they read, nothing else writes to it
+
+The cache is bounded by MAX_BYTES, the least recently used entries are removed first
+Any change to the source files in CODE_FILES invalidates every entry (the code version is a hash of them)
+'''
+
+import hashlib
+import os
+
+import numpy as np
+
+class FeatureCache:
+
+    # where the cache is stored (relative to the dataset path)
+    CACHE_DIRECTORY = 'dataset/cache/fronts'
+
+    # size limit of the cache, least recently used entries are removed past it (down to EVICT_TO of it)
+    MAX_BYTES = 256 << 20
+    EVICT_TO = 0.8
+
+    # source files that decide the front agents, relative to this package
+    CODE_FILES = ['agent.py', 'agentfinder.py', 'constants.py', 'data.py', 'packed.py', 'relations.py', 'scene.py', 'spatial.py', 'trajectory.py', 'utils.py']
+
+    # one record per frame
+    DTYPE = np.dtype([('slot', '<i2'), ('distance', '<f8'), ('dv', '<f8')])
+
+    # caches that are already open in this process, keyed by their absolute path
+    opened = {}
+
+    # maps (path, mtime, size) of a data file to the hash of its content
+    file_hashes = {}
+
+    # hash of CODE_FILES, computed on first use
+    code_version = None
+
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        # total size of the entries, found on first write
+        self.size = None
+
+    def shared(dataset_path=None):
+        '''The cache of a dataset (Data.root by default), shared by everything in this process'''
+        from .data import Data
+
+        path = os.path.abspath(os.path.join(Data.root if dataset_path is None else dataset_path, FeatureCache.CACHE_DIRECTORY))
+        if path not in FeatureCache.opened:
+            FeatureCache.opened[path] = FeatureCache(path)
+        return FeatureCache.opened[path]
+
+    ''' keys '''
+
+    def file_hash(file_path):
+        '''Hash of a file's content (only read again if the file changes)'''
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+        if key not in FeatureCache.file_hashes:
+            with open(file_path, 'rb') as f:
+                FeatureCache.file_hashes[key] = hashlib.sha1(f.read()).hexdigest()
+        return FeatureCache.file_hashes[key]
+
+    def get_code_version():
+        if FeatureCache.code_version is None:
+            digest = hashlib.sha1()
+            for name in FeatureCache.CODE_FILES:
+                with open(os.path.join(os.path.dirname(__file__), name), 'rb') as f:
+                    digest.update(f.read())
+            FeatureCache.code_version = digest.hexdigest()
+        return FeatureCache.code_version
+
+    def key(scene, parameters):
+        '''Name of the entry of a scene's front track with some finder parameters, None if the scene has no data file'''
+        if scene.file_path is None:
+            return None
+        parts = [FeatureCache.file_hash(scene.file_path), *map(str, parameters), FeatureCache.get_code_version()]
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, f'{key}.npy')
+
+    ''' entries '''
+
+    def get(self, scene, parameters):
+        '''(slots, distances, dvs) of a scene's front track, None if it is not cached'''
+        key = FeatureCache.key(scene, parameters)
+        if key is None:
+            return None
+        entry_path = self.entry_path(key)
+        try:
+            records = np.load(entry_path)
+            # mark the entry as recently used
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            # missing, or removed / half written by another process
+            return None
+        if records.dtype != FeatureCache.DTYPE:
+            # written by another version of the cache
+            return None
+        return records['slot'].astype(int), records['distance'], records['dv']
+
+    def put(self, scene, parameters, slots, distances, dvs):
+        key = FeatureCache.key(scene, parameters)
+        if key is None:
+            return
+        records = np.zeros(len(slots), dtype=FeatureCache.DTYPE)
+        records['slot'] = slots
+        records['distance'] = distances
+        records['dv'] = dvs
+
+        # write into a temporary file and move it in place, so readers never see a half-written entry
+        entry_path = self.entry_path(key)
+        temp_path = f'{entry_path}.tmp-{os.getpid()}'
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                np.save(f, records)
+            os.replace(temp_path, entry_path)
+        except OSError:
+            # the cache is only an optimization, a cache that cannot be written is skipped
+            return
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += os.path.getsize(entry_path)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        '''(path, size, last use) of every entry'''
+        entries = []
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if entry.name.endswith('.npy'):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            pass
+        return entries
+
+    def evict(self):
+        '''Removes the least recently used entries until the cache is below EVICT_TO of its size limit'''
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.size <= self.max_bytes * FeatureCache.EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.size = 0
+
+    def __str__(self):
+        return f'FeatureCache({self.path})'
+
+    def __repr__(self):
+        return self.__str__()
@@ -6,6 +6,7 @@ import numpy as np
 
 from .agent import Agent
 from .agentfinder import AgentFinder
+from .cache import FeatureCache
 from .constants import *
 from .scene import Scene
 
@@ -32,9 +33,11 @@ class SceneClassifier:
     CROSS_FORWARD_DELTA = 1
 
     # initialize object with scene
-    def __init__(self, scene: Scene):
+    def __init__(self, scene: Scene, cache: FeatureCache = None):
         self.scene = scene
-        self.finder = AgentFinder(scene)
+
+        # front tracks are looked up in the cache first if there is one (e.g. FeatureCache.shared(dataset_path))
+        self.finder = AgentFinder(scene, cache)
 
     # "main function"
     def classify_scene(self) -> list[str]:
@@ -77,7 +80,7 @@ class SceneClassifier:
     # inlane section classifier
     def classify_inlane_section(self, tis):
         n = len(tis)
-        fronts = [self.finder.get_front(ti) for ti in tis]
+        fronts = self.finder.get_fronts(tis)
         labels = [INVALID3] * n
 
         # for i from 0 -> n
@@ -170,7 +173,7 @@ class SceneClassifier:
     # stop and wait section classifier
     def classify_stop_and_wait_section(self, tis):
         n = len(tis)
-        fronts = [self.finder.get_front(ti) for ti in tis]
+        fronts = self.finder.get_fronts(tis)
         labels = [INVALID3] * n
 
         # for i from 0 -> n
@@ -205,7 +208,7 @@ class SceneClassifier:
     # go straight section classifier
     def classify_go_straight_section(self, tis):
         n = len(tis)
-        fronts = [self.finder.get_turning_front(ti) for ti in tis]
+        fronts = self.finder.get_turning_fronts(tis)
         labels = [INVALID3] * n
 
         # for i from 0 -> n
@@ -242,7 +245,7 @@ class SceneClassifier:
     # turn left section classifier
     def classify_turn_left_section(self, tis):
         n = len(tis)
-        fronts = [self.finder.get_turning_front(ti) for ti in tis]
+        fronts = self.finder.get_turning_fronts(tis)
         labels = [INVALID3] * n
 
         for i in range(n):
@@ -275,7 +278,7 @@ class SceneClassifier:
     # turn right section classifier
     def classify_turn_right_section(self, tis):
         n = len(tis)
-        fronts = [self.finder.get_turning_front(ti) for ti in tis]
+        fronts = self.finder.get_turning_fronts(tis)
         labels = [INVALID3] * n
 
         for i in range(n):
@@ -1,43 +1,195 @@
 '''
 Data('0.csv') gets the data and label files (with the same name) from DATA_DIRECTORY and LABELS_DIRECTORY
 Data.all_file_names gets all available file names that corresponds to both a data and a label
+(under Data.root, the directories are only listed the first time the names are used), and data.all_file_names those of
+the dataset a Data was loaded from
+
+Data is loaded from the packed copy of the dataset (see packed.py), which is built the first time it is needed
+Data('0.csv', packed=False) parses the csv files directly instead
+Data.frame(ti) gets the agent rows of a timestamp index as numpy views, without building a dataframe
+
+Data.iter_scenes(file_names, prefetch=4) yields the Data of every file name in order, while the next ones are read on
+background threads, so a loop that classifies each scene does not wait on storage (e.g. a network-mounted dataset)
 '''
 
+import collections
+import itertools
 import os
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from .packed import PackedDataset
+
+# pandas is only imported by the functions that use it, the pipeline reads the packed dataset
+if TYPE_CHECKING:
+    import pandas as pd
+
+class DataFiles(type):
+    '''Makes the file names of the dataset under Data.root class properties of Data, listed on first use'''
+
+    @property
+    def data_file_names(cls) -> set[str]:
+        # all files in the data directory
+        return cls.file_names(cls.root)[0]
+
+    @property
+    def label_file_names(cls) -> set[str]:
+        # all files in the label directory
+        return cls.file_names(cls.root)[1]
 
-class Data:
+    @property
+    def all_file_names(cls) -> set[str]:
+        # all file names that exist both in the data and label directory
+        # if a file name exist in both paths, they contain data and label information for the same video.
+        return cls.file_names(cls.root)[2]
 
-    # where all data csvs are stored
+class Data(metaclass=DataFiles):
+
+    # where all data csvs are stored (relative to the dataset path)
     DATA_DIRECTORY = 'dataset/data'
     LABELS_DIRECTORY = 'dataset/labels'
 
-    # all files in the data and label directory
-    data_file_names = os.listdir(DATA_DIRECTORY)
-    label_file_names = os.listdir(LABELS_DIRECTORY)
+    # dataset path used when none is given, set it to use a dataset outside the working directory
+    root = '.'
+
+    # maps the absolute path of a dataset to its (data, label, all) file names, clear it to list the directories again
+    listed = {}
 
-    # all file names that exist both in the data and label directory
-    # if a file name exist in both paths, they contain data and label information for the same video.
-    all_file_names = set(data_file_names).intersection(set(label_file_names))
+    # how many scenes iter_scenes reads ahead by default
+    PREFETCH = 4
 
-    def __init__(self, file_name, dataset_path='.'):
+    def __init__(self, file_name, dataset_path=None, packed=True):
+        dataset_path = Data.root if dataset_path is None else dataset_path
 
         # do not allow a non-existent file name
-        if file_name not in Data.all_file_names:
+        if file_name not in Data.file_names(dataset_path)[2]:
             raise Exception(f'Cannot construct Data({file_name}) because the file does not exist')
         
         self.file_name = file_name
-        
+        self.dataset_path = dataset_path
+
+        # "columns" maps each csv column name to an array of all rows in the file, sorted by timestamp
+        # "frame_bounds[ti]:frame_bounds[ti+1]" are the rows of timestamp index ti
+        # "labels" maps first_class, second_class, and third_class to an array with one label per timestamp index
+        if packed:
+            self.load_packed(dataset_path)
+        else:
+            self.load_csv(dataset_path)
+
+    def file_names(dataset_path=None) -> tuple[set[str], set[str], set[str]]:
+        '''Data file names, label file names, and the file names with both, of the dataset under dataset_path'''
+        path = os.path.abspath(Data.root if dataset_path is None else dataset_path)
+        if path not in Data.listed:
+            data_file_names = set(os.listdir(os.path.join(path, Data.DATA_DIRECTORY)))
+            label_file_names = set(os.listdir(os.path.join(path, Data.LABELS_DIRECTORY)))
+            Data.listed[path] = data_file_names, label_file_names, data_file_names.intersection(label_file_names)
+        return Data.listed[path]
+
+    def iter_scenes(file_names, prefetch=PREFETCH, dataset_path=None, packed=True):
+        '''
+        Data of every file name, in order, with the next "prefetch" scenes read on background threads meanwhile
+
+        at most prefetch scenes are held besides the one that was yielded last, and the rows of prefetched packed scenes
+        are read into memory; an error reading a scene is raised when that scene is reached
+        '''
+        # pack and list the dataset here, so the threads only read
+        if packed:
+            PackedDataset.load(dataset_path)
+        Data.file_names(dataset_path)
+
+        if prefetch <= 0:
+            for file_name in file_names:
+                yield Data(file_name, dataset_path, packed)
+            return
+
+        def read(file_name):
+            data = Data(file_name, dataset_path, packed)
+            if packed:
+                data.columns = {name: np.array(column) for name, column in data.columns.items()}
+            return data
+
+        file_names = iter(file_names)
+        pending = collections.deque()
+        with ThreadPoolExecutor(prefetch, thread_name_prefix='iter_scenes') as executor:
+            try:
+                for file_name in itertools.islice(file_names, prefetch):
+                    pending.append(executor.submit(read, file_name))
+                while pending:
+                    data = pending.popleft().result()
+                    # the next scene starts reading before this one is used
+                    for file_name in itertools.islice(file_names, 1):
+                        pending.append(executor.submit(read, file_name))
+                    yield data
+            finally:
+                # stopped early, the scenes that did not start are not read
+                for future in pending:
+                    future.cancel()
+
+    def load_packed(self, dataset_path):
+        # numeric columns are views into the memory-mapped packed dataset, nothing is read until it is used
+        packed = PackedDataset.load(dataset_path)
+        self.columns: dict[str, np.ndarray] = packed.scene_columns(self.file_name)
+        self.frame_bounds: np.ndarray = packed.frame_bounds(self.file_name)
+        self.labels: dict[str, np.ndarray] = packed.scene_labels(self.file_name)
+
+    def load_csv(self, dataset_path):
+        import pandas as pd
+
+        file_name = self.file_name
+
         # get the full path of the specified data and label file
-        data_file_path = os.path.join(dataset_path, Data.DATA_DIRECTORY, file_name)
+        data_file_path = self.file_path
         label_file_path = os.path.join(dataset_path, Data.LABELS_DIRECTORY, file_name)
 
+        # stable sort keeps the csv order of agents within a timestamp (same as groupby)
+        df = pd.read_csv(data_file_path).sort_values('TIMESTAMP', kind='stable')
+        self.columns = {name: df[name].to_numpy() for name in df.columns}
+        _, frame_lengths = np.unique(self.columns['TIMESTAMP'], return_counts=True)
+        self.frame_bounds = PackedDataset.offsets(frame_lengths)
+
+        label_df = pd.read_csv(label_file_path)
+        self.labels = {name: label_df[name].to_numpy() for name in label_df.columns}
+
+    @property
+    def data_file_names(self) -> set[str]:
+        # the class properties of the metaclass are not visible from instances, these list the dataset of this Data
+        return Data.file_names(self.dataset_path)[0]
+
+    @property
+    def label_file_names(self) -> set[str]:
+        return Data.file_names(self.dataset_path)[1]
+
+    @property
+    def all_file_names(self) -> set[str]:
+        return Data.file_names(self.dataset_path)[2]
+
+    @property
+    def file_path(self):
+        return os.path.join(self.dataset_path, Data.DATA_DIRECTORY, self.file_name)
+
+    def frame(self, ti) -> dict[str, np.ndarray]:
+        '''Maps each column name to the rows of timestamp index ti (views, not copies)'''
+        start, end = self.frame_bounds[ti], self.frame_bounds[ti+1]
+        return {name: column[start:end] for name, column in self.columns.items()}
+
+    def frames(self) -> list[dict[str, np.ndarray]]:
+        '''All frames ordered by timestamp'''
+        return [self.frame(ti) for ti in range(len(self.frame_bounds) - 1)]
+
+    @property
+    def dfs(self) -> list['pd.DataFrame']:
         # "dfs" is a list of "df"s ordered by timestamp, each "df" contains agent information (organized in rows)
-        self.dfs = [df for _, df in sorted(pd.read_csv(data_file_path).groupby('TIMESTAMP'))]
+        # built on demand, the pipeline itself reads frames directly
+        import pandas as pd
+        return [pd.DataFrame(frame) for frame in self.frames()]
 
+    @property
+    def label_df(self) -> 'pd.DataFrame':
         # label dataframe contains first_class, second_class, and third_class for each timestamp index
-        self.label_df = pd.read_csv(label_file_path)
-
+        import pandas as pd
+        return pd.DataFrame(self.labels)
     
     def __str__(self):
         return f'Data({self.file_name})'
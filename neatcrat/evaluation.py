@@ -0,0 +1,155 @@
+'''
+Evaluates predicted third class labels against the true ones
+
+Evaluation.from_labels(predicted, true) encodes both label arrays with their THIRD_CLASSES codes and counts them into a
+confusion matrix (one bincount), precision, recall and F1 of every class are read off the matrix
+Evaluation.by_second_class(predicted, true, second_classes) does the same for every second class at once
+
+Rows and columns of the confusion matrix are the third classes in code order, then INVALID3,
+then OTHER for labels that are not in THIRD_CLASSES (the true labels have many classes the classifier does not predict)
+
+Run `python -m neatcrat.evaluation labels.jsonl` to evaluate the output of `python -m neatcrat.run`
+'''
+
+import json
+import sys
+
+import numpy as np
+
+from .constants import THIRD_CLASSES, THIRD_CLASSES_NAMES, INVALID3
+from .packed import PackedDataset
+
+class Evaluation:
+
+    # name of the row and column of labels that are not in THIRD_CLASSES
+    OTHER = 'other'
+
+    # third classes that can be predicted (codes 0, 1, ...), and the names of all rows and columns
+    N_CLASSES = len([code for code in THIRD_CLASSES.values() if code >= 0])
+    CLASS_NAMES = [THIRD_CLASSES_NAMES[code] for code in range(N_CLASSES)] + [INVALID3, OTHER]
+
+    # maps a label name to its row (or column)
+    ROWS = {name: i for i, name in enumerate(CLASS_NAMES)}
+
+    def __init__(self, confusion):
+        # confusion[true, predicted] is the number of frames with that true and predicted label
+        self.confusion: np.ndarray = confusion
+
+    def encode(labels) -> np.ndarray:
+        '''Row (or column) of each label in the confusion matrix'''
+        # a dict lookup per label is faster than sorting strings (np.unique) for label arrays of this size
+        labels = labels.tolist() if isinstance(labels, np.ndarray) else labels
+        rows, other = Evaluation.ROWS, Evaluation.ROWS[Evaluation.OTHER]
+        return np.fromiter((rows.get(label, other) for label in labels), dtype=np.int64, count=len(labels))
+
+    def from_labels(predicted, true):
+        '''Evaluation of predicted labels against true labels (one per frame, of any number of scenes)'''
+        n = len(Evaluation.CLASS_NAMES)
+        keys = Evaluation.encode(true) * n + Evaluation.encode(predicted)
+        return Evaluation(np.bincount(keys, minlength=n * n).reshape(n, n))
+
+    def by_second_class(predicted, true, second_classes):
+        '''Maps each second class to the evaluation of its frames'''
+        n = len(Evaluation.CLASS_NAMES)
+        second_classes = second_classes.tolist() if isinstance(second_classes, np.ndarray) else second_classes
+
+        # second classes are numbered in order of appearance, and every (second class, true, predicted) is counted at once
+        sections = {}
+        section_rows = np.fromiter((sections.setdefault(name, len(sections)) for name in second_classes), dtype=np.int64, count=len(second_classes))
+        keys = (section_rows * n + Evaluation.encode(true)) * n + Evaluation.encode(predicted)
+        confusions = np.bincount(keys, minlength=len(sections) * n * n).reshape(len(sections), n, n)
+        return {name: Evaluation(confusion) for name, confusion in zip(sections, confusions)}
+
+    def from_results(results_path, dataset_path=None):
+        '''
+        Evaluations of a results file of `python -m neatcrat.run` against the labels of the dataset
+
+        returns the evaluation of all frames and the evaluations by second class, scenes that failed are left out
+        '''
+        packed = PackedDataset.load(dataset_path)
+        predicted, true, second_classes = [], [], []
+        with open(results_path) as f:
+            for line in f:
+                result = json.loads(line)
+                if 'labels' not in result:
+                    continue
+                labels = packed.scene_labels(result['file_name'])
+                predicted += result['labels']
+                true.append(labels['third_class'])
+                second_classes.append(labels['second_class'])
+
+        true = np.concatenate(true) if true else np.zeros(0, dtype=str)
+        second_classes = np.concatenate(second_classes) if second_classes else np.zeros(0, dtype=str)
+        return Evaluation.from_labels(predicted, true), Evaluation.by_second_class(predicted, true, second_classes)
+
+    ''' metrics '''
+
+    @property
+    def frames(self):
+        return int(self.confusion.sum())
+
+    @property
+    def support(self) -> np.ndarray:
+        '''Number of frames that truly are each class'''
+        return self.confusion.sum(axis=1)
+
+    @property
+    def predicted(self) -> np.ndarray:
+        '''Number of frames predicted as each class'''
+        return self.confusion.sum(axis=0)
+
+    @property
+    def accuracy(self):
+        return np.trace(self.confusion) / self.frames if self.frames else np.nan
+
+    @property
+    def precision(self) -> np.ndarray:
+        # nan for classes that are never predicted
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.diag(self.confusion) / self.predicted
+
+    @property
+    def recall(self) -> np.ndarray:
+        # nan for classes that never appear
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.diag(self.confusion) / self.support
+
+    @property
+    def f1(self) -> np.ndarray:
+        # harmonic mean of precision and recall, same as 2 * tp / (support + predicted)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 2 * np.diag(self.confusion) / (self.support + self.predicted)
+
+    @property
+    def macro_f1(self):
+        '''Average F1 of the third classes that appear or are predicted'''
+        f1 = self.f1[:Evaluation.N_CLASSES]
+        return np.nanmean(f1) if not np.isnan(f1).all() else np.nan
+
+    def normalized(self) -> np.ndarray:
+        '''Confusion matrix with every row divided by its support (same as PrintConfusionMatrix)'''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.confusion / self.support[:, None]
+
+    def report(self):
+        '''Per class table of support, precision, recall and F1'''
+        lines = [f'{"class":<36}{"support":>9}{"precision":>11}{"recall":>9}{"f1":>9}']
+        for i, name in enumerate(Evaluation.CLASS_NAMES):
+            if self.support[i] or self.predicted[i]:
+                lines.append(f'{name:<36}{self.support[i]:>9}{self.precision[i]:>11.3f}{self.recall[i]:>9.3f}{self.f1[i]:>9.3f}')
+        lines.append(f'{self.frames} frames, accuracy {self.accuracy:.3f}, macro f1 {self.macro_f1:.3f}')
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return f'Evaluation({self.frames} frames, accuracy {self.accuracy:.3f})'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+if __name__ == '__main__':
+    evaluation, by_second_class = Evaluation.from_results(sys.argv[1] if len(sys.argv) > 1 else 'labels.jsonl')
+    print(evaluation.report())
+    for second_class, second_class_evaluation in by_second_class.items():
+        print(f'\n{second_class}')
+        print(second_class_evaluation.report())
@@ -0,0 +1,171 @@
+'''
+Ego-relative features of every agent row of the dataset, computed for the whole corpus at once
+
+A port of previous_reference/cratutils.ProcessVideos onto the packed dataset: the features and the filter are the same
+(degrees, theta measured from the ego's heading with right positive, the "valuable" agents only), but instead of a
+dataframe per frame, every row of every scene is converted in one pass over the packed arrays, with the ego row of each
+frame broadcast to the rest of its rows
+
+Features.load() returns one (rows x FEATURES) matrix, scene_offsets[i]:scene_offsets[i+1] are the frames of scene names[i]
+and frame_offsets[f]:frame_offsets[f+1] are the rows of frame f
+Like ProcessVideos, frames whose labels are not classes of the model (e.g. 9.9.9 Invalid) are left out
+'''
+
+import numpy as np
+
+from .constants import FIRST_CLASSES, OBJECT_TYPES, SECOND_CLASSES, THIRD_CLASSES
+from .packed import PackedDataset
+from .utils import Angle
+
+class Features:
+
+    # columns of the feature matrix, in the order of ProcessVideos
+    FEATURES = ['x', 'y', 'yaw', 'dyaw', 'ddyaw', 'vx', 'vy', 'ax', 'ay', 'r', 'theta', 'vr', 'vtheta', 'ar', 'atheta', 'type', 'first_class', 'second_class', 'third_class']
+    COLUMNS = {name: i for i, name in enumerate(FEATURES)}
+
+    # maps each label column to its class codes (-1 is not a class)
+    LABEL_CODES = {'first_class': FIRST_CLASSES, 'second_class': SECOND_CLASSES, 'third_class': THIRD_CLASSES}
+
+    def __init__(self, names, matrix, scene_offsets, frame_offsets, frame_numbers, source_rows, tracks, track_names):
+        # "names" are the scene file names, "matrix" holds one row of FEATURES per kept agent row
+        self.names: list[str] = names
+        self.index: dict[str, int] = {name: i for i, name in enumerate(names)}
+        self.matrix: np.ndarray = matrix
+
+        # "scene_offsets" index frames and "frame_offsets" index rows of the matrix
+        # "source_rows" are the rows of the packed dataset the matrix rows come from
+        self.scene_offsets: np.ndarray = scene_offsets
+        self.frame_offsets: np.ndarray = frame_offsets
+
+        # "frame_numbers" are the positions of the frames in their scenes (the ti of Scene)
+        self.frame_numbers: np.ndarray = frame_numbers
+        self.source_rows: np.ndarray = source_rows
+
+        # "tracks" are the TRACK_ID codes of the matrix rows, "track_names" the TRACK_IDs they refer to
+        self.tracks: np.ndarray = tracks
+        self.track_names: np.ndarray = track_names
+
+    def load(dataset_path=None, valuable_only=True):
+        '''Features of the whole dataset under dataset_path'''
+        return Features.from_packed(PackedDataset.load(dataset_path), valuable_only)
+
+    def from_packed(packed: PackedDataset, valuable_only=True):
+        columns = packed.columns
+        n_frames = len(packed.frame_offsets) - 1
+        if not np.array_equal(packed.label_offsets, packed.scene_frame_offsets):
+            raise ValueError(f'Cannot compute features of {packed} because some scenes do not have one label per frame')
+
+        # frame of every row, and the ego row of every frame (-1 if the frame has no ego)
+        frame_lengths = np.diff(packed.frame_offsets)
+        frames = np.repeat(np.arange(n_frames), frame_lengths)
+        ego_code = np.flatnonzero(packed.vocabularies['TRACK_ID'] == 'ego')
+        ego_rows = np.flatnonzero(np.isin(columns['TRACK_ID'], ego_code))
+        ego_row = np.full(n_frames, -1)
+        ego_row[frames[ego_rows]] = ego_rows
+
+        # class codes of every frame, and object type codes of every row (-1 where they are not known)
+        labels = {name: Features.codes(packed.vocabularies[name], codes)[packed.labels[name]] for name, codes in Features.LABEL_CODES.items()}
+        types = Features.codes(packed.vocabularies['OBJECT_TYPE'], OBJECT_TYPES)[columns['OBJECT_TYPE']]
+
+        # rows that ProcessVideos would see: rows of frames with an ego and with labels of the model, and with no missing values
+        kept = (ego_row[frames] >= 0) & (types >= 0)
+        for codes in labels.values():
+            kept &= codes[frames] >= 0
+        for name in PackedDataset.NUMERIC_COLUMNS:
+            kept &= ~np.isnan(columns[name])
+
+        rows = np.flatnonzero(kept)
+        row_frames = frames[rows]
+        egos = ego_row[row_frames]
+        column = lambda name: np.asarray(columns[name][rows], dtype=np.float64)
+        ego_column = lambda name: np.asarray(columns[name][egos], dtype=np.float64)
+
+        # everything is turned by the ego's yaw, as cratutils.spin does (theta is measured from +y, right is positive)
+        turn = Angle.normalize(ego_column('YAW'))
+        cos, sin = Angle.cos(turn), Angle.sin(turn)
+
+        def spin(xs, ys):
+            return xs * cos + ys * sin, ys * cos - xs * sin
+
+        def rtheta(xs, ys):
+            return np.sqrt(xs ** 2 + ys ** 2), Angle.deg(np.arctan2(xs, ys))
+
+        features = {}
+        features['x'], features['y'] = spin(column('X') - ego_column('X'), column('Y') - ego_column('Y'))
+        features['yaw'] = -Angle.normalize(column('YAW') + turn)
+        features['dyaw'] = -Angle.normalize(column('DYAW'))
+        features['ddyaw'] = -Angle.normalize(column('DDYAW'))
+        features['vx'], features['vy'] = spin(column('V_X'), column('V_Y'))
+        features['ax'], features['ay'] = spin(column('A_X'), column('A_Y'))
+        features['r'], features['theta'] = rtheta(features['x'], features['y'])
+        features['vr'], features['vtheta'] = rtheta(features['vx'], features['vy'])
+        features['ar'], features['atheta'] = rtheta(features['ax'], features['ay'])
+        features['type'] = types[rows]
+        for name, codes in labels.items():
+            features[name] = codes[row_frames]
+
+        matrix = np.column_stack([features[name] for name in Features.FEATURES])
+
+        # a frame with none of its rows kept is left out (ProcessVideos never sees it), the filter can empty a frame though
+        frame_kept = np.bincount(row_frames, minlength=n_frames) > 0
+        if valuable_only:
+            valuable = Features.valuable(matrix)
+            matrix, rows, row_frames = matrix[valuable], rows[valuable], row_frames[valuable]
+
+        kept_frames = np.flatnonzero(frame_kept)
+        frame_offsets = PackedDataset.offsets(np.bincount(row_frames, minlength=n_frames)[kept_frames])
+        scene_offsets = np.searchsorted(kept_frames, packed.scene_frame_offsets)
+        frame_numbers = kept_frames - packed.scene_frame_offsets[np.searchsorted(packed.scene_frame_offsets, kept_frames, side='right') - 1]
+        tracks = np.asarray(columns['TRACK_ID'][rows])
+        return Features(list(packed.names), matrix, scene_offsets, frame_offsets, frame_numbers, rows, tracks, packed.vocabularies['TRACK_ID'])
+
+    def codes(vocabulary, classes) -> np.ndarray:
+        '''Class code of each word of a vocabulary (-1 if it is not a class)'''
+        return np.array([classes.get(word, -1) for word in vocabulary.tolist()], dtype=np.int64)
+
+    def valuable(matrix) -> np.ndarray:
+        '''Mask of the rows ProcessVideos keeps: agents near the ego's path, ahead of it, or heading across it ahead, and ego'''
+        column = lambda name: matrix[:, Features.COLUMNS[name]]
+        x, y, yaw, r, theta, object_type = (column(name) for name in ['x', 'y', 'yaw', 'r', 'theta', 'type'])
+        ahead = (-90 <= theta) & (theta <= 90)
+        return (
+            ((-3 <= x) & (x <= 3) & (-10 <= theta) & (theta <= 10))
+            | (ahead & (r <= 15))
+            | ((yaw - theta >= 20) & (r <= 30) & ahead & (y >= 0))
+            | (object_type == OBJECT_TYPES['AV'])
+        )
+
+    ''' access '''
+
+    def scene_rows(self, file_name):
+        '''Row range (start, end) of a scene in the feature matrix'''
+        i = self.index[file_name]
+        return int(self.frame_offsets[self.scene_offsets[i]]), int(self.frame_offsets[self.scene_offsets[i+1]])
+
+    def scene(self, file_name):
+        '''(rows of the feature matrix, frame offsets relative to the first row) of a scene'''
+        i = self.index[file_name]
+        frame_offsets = self.frame_offsets[self.scene_offsets[i] : self.scene_offsets[i+1] + 1]
+        return self.matrix[frame_offsets[0] : frame_offsets[-1]], frame_offsets - frame_offsets[0]
+
+    def ego_rows(self) -> np.ndarray:
+        '''Row of the ego in every frame'''
+        ego_code = np.flatnonzero(self.track_names == 'ego')
+        rows = np.flatnonzero(np.isin(self.tracks, ego_code))
+        ego_rows = np.full(len(self.frame_offsets) - 1, -1)
+        ego_rows[np.searchsorted(self.frame_offsets, rows, side='right') - 1] = rows
+        return ego_rows
+
+    def frames(self, file_name) -> list[np.ndarray]:
+        '''Rows of each frame of a scene (the layout of ProcessVideos, with arrays instead of dataframes)'''
+        matrix, frame_offsets = self.scene(file_name)
+        return [matrix[start:end] for start, end in zip(frame_offsets[:-1], frame_offsets[1:])]
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def __str__(self):
+        return f'Features({len(self.names)} scenes, {len(self.frame_offsets) - 1} frames, {len(self.matrix)} rows)'
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,147 @@
+'''
+Opt-in instrumentation of the pipeline: calls and time of the hot functions, and counters of the work they do
+
+Instruments.enable() wraps every function in TIMED with a timer, Instruments.disable() puts the originals back,
+so nothing is timed (or slowed down) unless it is enabled; the counters inside hot loops cost one check of Instruments.enabled
+
+Timings are kept per call stack of timed functions (e.g. "SceneClassifier.classify_scene;SceneClassifier.classify_inlane_section"),
+counters are:
+    front searches: searches for a front agent (one per frame of AgentFinder.front_track, or AgentFinder.front_of)
+    anchors walked: ego anchors a search went through before it found an agent on track (all of them if it did not)
+    extrapolated agents: agents extrapolated past the known agents of a trajectory (Horizon.extend)
+
+with Instruments.scene() as report: collects the report of one scene (they are also added to the totals),
+Instruments.report() is the report of everything so far, and Instruments.collapsed(report) is its self time per stack
+in the collapsed format of flamegraph.pl / speedscope (in microseconds)
+
+`python -m neatcrat.run --instrument out` writes the report of every scene into its line of the results,
+and the report of the whole run into out.json and out.folded
+'''
+
+import contextlib
+import functools
+import importlib
+import time
+
+class Instruments:
+
+    # functions that are timed, as (module, class, function names)
+    TIMED = [
+        ('.scene', 'Scene', ['from_data']),
+        ('.classifier', 'SceneClassifier', [
+            'classify_scene',
+            'classify_inlane_section',
+            'classify_stop_and_wait_section',
+            'classify_go_straight_section',
+            'classify_turn_left_section',
+            'classify_turn_right_section',
+            'classify_uturn_section',
+        ]),
+        ('.agentfinder', 'AgentFinder', ['get_front', 'get_fronts', 'front_track', 'front_of', 'relative_velocities']),
+        ('.trajectory', 'Trajectory', ['poses']),
+        ('.trajectory', 'Horizon', ['extend']),
+    ]
+
+    enabled = False
+
+    # maps (class, function name) to the original function of every wrapped function
+    originals = {}
+
+    # names of the timed functions that are running, outermost first
+    stack = []
+
+    # "timings" maps a call stack (names joined by ;) to [calls, seconds], "counters" maps a counter name to its value
+    timings: dict[str, list] = {}
+    counters: dict[str, float] = {}
+
+    def enable():
+        if Instruments.enabled:
+            return
+        for module_name, class_name, function_names in Instruments.TIMED:
+            cls = getattr(importlib.import_module(module_name, __package__), class_name)
+            for function_name in function_names:
+                function = vars(cls)[function_name]
+                Instruments.originals[cls, function_name] = function
+                setattr(cls, function_name, Instruments.timed(f'{class_name}.{function_name}', function))
+        Instruments.enabled = True
+
+    def disable():
+        for (cls, function_name), function in Instruments.originals.items():
+            setattr(cls, function_name, function)
+        Instruments.originals = {}
+        Instruments.enabled = False
+
+    def reset():
+        Instruments.timings = {}
+        Instruments.counters = {}
+
+    def timed(name, function):
+        '''function, timed under the stack of timed functions that call it'''
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            Instruments.stack.append(name)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                timing = Instruments.timings.setdefault(';'.join(Instruments.stack), [0, 0.0])
+                timing[0] += 1
+                timing[1] += seconds
+                Instruments.stack.pop()
+        return wrapper
+
+    def count(name, value=1):
+        # only called behind `if Instruments.enabled`
+        Instruments.counters[name] = Instruments.counters.get(name, 0) + value
+
+    ''' reports '''
+
+    def report():
+        '''Timings and counters so far, as json-able dicts'''
+        return {'timings': {stack: list(timing) for stack, timing in Instruments.timings.items()}, 'counters': dict(Instruments.counters)}
+
+    @contextlib.contextmanager
+    def scene():
+        '''Collects the timings and counters of the block into the yielded report (they are also added to the totals)'''
+        report = {}
+        timings, counters = Instruments.timings, Instruments.counters
+        Instruments.reset()
+        try:
+            yield report
+        finally:
+            report.update(Instruments.report())
+            Instruments.timings, Instruments.counters = timings, counters
+            Instruments.merge(report)
+
+    def merge(report, into=None):
+        '''Adds a report (e.g. of a scene that ran in another process) to the totals, or to another report'''
+        timings, counters = (Instruments.timings, Instruments.counters) if into is None else (into['timings'], into['counters'])
+        for stack, (calls, seconds) in report['timings'].items():
+            timing = timings.setdefault(stack, [0, 0.0])
+            timing[0] += calls
+            timing[1] += seconds
+        for name, value in report['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+
+    def collapsed(report) -> str:
+        '''Self time of every call stack of a report in microseconds, one "stack time" line each'''
+        timings = report['timings']
+
+        # the time of a stack includes the stacks it called, which are the stack and one more name
+        self_seconds = {stack: seconds for stack, (_, seconds) in timings.items()}
+        for stack, (_, seconds) in timings.items():
+            caller = stack.rpartition(';')[0]
+            if caller in self_seconds:
+                self_seconds[caller] -= seconds
+
+        return '\n'.join(f'{stack} {max(0, round(seconds * 1e6))}' for stack, seconds in sorted(self_seconds.items()))
+
+    def table(report) -> str:
+        '''Calls, total and mean time of every call stack of a report, and its counters'''
+        lines = [f'{"calls":>9}{"seconds":>10}{"mean ms":>10}  stack']
+        for stack, (calls, seconds) in sorted(report['timings'].items()):
+            lines.append(f'{calls:>9}{seconds:>10.3f}{seconds / calls * 1000:>10.3f}  {stack}')
+        for name, value in sorted(report['counters'].items()):
+            lines.append(f'{name}: {value}')
+        return '\n'.join(lines)
@@ -0,0 +1,274 @@
+'''
+Columnar (packed) copy of the whole dataset
+
+PackedDataset.load() packs every data and label csv into one typed array per column the first time it is called,
+and reuses the packed copy afterwards until a csv file is added, removed or modified
+
+The packed arrays are memory-mapped, so opening a scene only reads the pages of that scene,
+and every process that loads the same packed copy shares one copy of it in the page cache
+
+Run `python -m neatcrat.packed` from the repository root to pack the dataset ahead of time
+'''
+
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+class PackedDataset:
+
+    # where the packed arrays are stored (relative to the dataset path)
+    PACKED_DIRECTORY = 'dataset/packed'
+
+    # bump when the layout of the packed files changes, older packed copies are then rebuilt
+    FORMAT_VERSION = 1
+
+    # numeric data columns and the dtype they are stored in
+    # everything the pipeline reads is kept in float64 so packed and csv-parsed values are identical
+    # DDYAW is not used by the model and is stored in float32
+    NUMERIC_COLUMNS = {
+        'TIMESTAMP': np.float64,
+        'X': np.float64,
+        'Y': np.float64,
+        'V_X': np.float64,
+        'V_Y': np.float64,
+        'A_X': np.float64,
+        'A_Y': np.float64,
+        'YAW': np.float64,
+        'DYAW': np.float64,
+        'DDYAW': np.float32,
+    }
+
+    # string data columns, stored as integer codes into a vocabulary
+    ENCODED_COLUMNS = {
+        'TRACK_ID': np.int32,
+        'OBJECT_TYPE': np.int8,
+        'CITY_NAME': np.int8,
+    }
+
+    # string label columns, stored as integer codes into a vocabulary
+    LABEL_COLUMNS = ['first_class', 'second_class', 'third_class']
+
+    # column order of the original csv files
+    DATA_COLUMN_ORDER = ['TIMESTAMP', 'TRACK_ID', 'OBJECT_TYPE', 'X', 'Y', 'V_X', 'V_Y', 'A_X', 'A_Y', 'YAW', 'DYAW', 'DDYAW', 'CITY_NAME']
+
+    # packed datasets that are already loaded in this process, keyed by their absolute dataset path
+    loaded = {}
+
+    def __init__(self, dataset_path, meta, columns, labels, vocabularies, offsets):
+        self.dataset_path = dataset_path
+        self.meta = meta
+
+        # "names" are the csv file names in packed order, "index" maps a file name to its position
+        self.names: list[str] = meta['names']
+        self.index: dict[str, int] = {name: i for i, name in enumerate(self.names)}
+
+        # "columns" maps a data column name to one array holding that column for every row of every scene
+        # rows are grouped by scene (in packed order) and sorted by timestamp within a scene
+        self.columns: dict[str, np.ndarray] = columns
+
+        # "labels" maps a label column name to one array of codes holding every frame of every scene
+        self.labels: dict[str, np.ndarray] = labels
+
+        # "vocabularies" maps an encoded column name to the array of strings its codes refer to
+        self.vocabularies: dict[str, np.ndarray] = vocabularies
+
+        # scene_offsets[i]:scene_offsets[i+1] are the rows of scene i
+        # scene_frame_offsets[i]:scene_frame_offsets[i+1] are the frames of scene i (indices into frame_offsets)
+        # frame_offsets[f]:frame_offsets[f+1] are the rows of frame f
+        # label_offsets[i]:label_offsets[i+1] are the label rows of scene i
+        self.scene_offsets: np.ndarray = offsets['scene_offsets']
+        self.scene_frame_offsets: np.ndarray = offsets['scene_frame_offsets']
+        self.frame_offsets: np.ndarray = offsets['frame_offsets']
+        self.label_offsets: np.ndarray = offsets['label_offsets']
+
+    ''' loading and packing '''
+
+    def load(dataset_path=None, mmap=True):
+        '''Returns the packed dataset under dataset_path (Data.root by default), packing it first if it is missing or stale'''
+
+        dataset_path = PackedDataset.dataset_root(dataset_path)
+        key = (os.path.abspath(dataset_path), mmap)
+        if key in PackedDataset.loaded:
+            return PackedDataset.loaded[key]
+
+        packed_path = PackedDataset.packed_path(dataset_path)
+        meta = PackedDataset.read_meta(packed_path)
+
+        # (re)pack if the packed copy does not describe the current csv files
+        if meta is None or meta['files'] != PackedDataset.file_stats(dataset_path):
+            PackedDataset.pack(dataset_path)
+            meta = PackedDataset.read_meta(packed_path)
+
+        packed = PackedDataset.read(dataset_path, meta, mmap)
+        PackedDataset.loaded[key] = packed
+        return packed
+
+    def dataset_root(dataset_path=None):
+        '''dataset_path, or Data.root if it is None'''
+        from .data import Data
+        return Data.root if dataset_path is None else dataset_path
+
+    def packed_path(dataset_path):
+        return os.path.join(dataset_path, PackedDataset.PACKED_DIRECTORY)
+
+    def read_meta(packed_path):
+        # meta.json is written last, so a packed directory without it is incomplete
+        try:
+            with open(os.path.join(packed_path, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != PackedDataset.FORMAT_VERSION:
+            return None
+        return meta
+
+    def read(dataset_path, meta, mmap=True):
+        packed_path = PackedDataset.packed_path(dataset_path)
+
+        def array(name):
+            return np.load(os.path.join(packed_path, f'{name}.npy'), mmap_mode='r' if mmap else None)
+
+        columns = {name: array(name) for name in [*PackedDataset.NUMERIC_COLUMNS, *PackedDataset.ENCODED_COLUMNS]}
+        labels = {name: array(name) for name in PackedDataset.LABEL_COLUMNS}
+        vocabularies = {name: array(f'{name}.vocabulary') for name in [*PackedDataset.ENCODED_COLUMNS, *PackedDataset.LABEL_COLUMNS]}
+        offsets = {name: array(name) for name in ['scene_offsets', 'scene_frame_offsets', 'frame_offsets', 'label_offsets']}
+
+        return PackedDataset(dataset_path, meta, columns, labels, vocabularies, offsets)
+
+    def file_stats(dataset_path):
+        '''Maps every file name that has both a data and a label csv to the (mtime, size) of both files'''
+
+        from .data import Data
+
+        data_directory = os.path.join(dataset_path, Data.DATA_DIRECTORY)
+        labels_directory = os.path.join(dataset_path, Data.LABELS_DIRECTORY)
+        file_names = set(os.listdir(data_directory)).intersection(os.listdir(labels_directory))
+
+        stats = {}
+        for file_name in sorted(file_names):
+            data_stat = os.stat(os.path.join(data_directory, file_name))
+            label_stat = os.stat(os.path.join(labels_directory, file_name))
+            stats[file_name] = [data_stat.st_mtime_ns, data_stat.st_size, label_stat.st_mtime_ns, label_stat.st_size]
+        return stats
+
+    def pack(dataset_path=None):
+        '''Reads every csv under dataset_path (Data.root by default) once and writes the packed arrays'''
+
+        # pandas is only needed to parse the csv files, loading a packed copy does not import it
+        import pandas as pd
+
+        from .data import Data
+
+        dataset_path = PackedDataset.dataset_root(dataset_path)
+        stats = PackedDataset.file_stats(dataset_path)
+        names = list(stats)
+
+        data_dfs = []
+        label_dfs = []
+        for file_name in names:
+            df = pd.read_csv(os.path.join(dataset_path, Data.DATA_DIRECTORY, file_name))
+            # stable sort keeps the csv order of agents within a timestamp (same as groupby)
+            data_dfs.append(df.sort_values('TIMESTAMP', kind='stable'))
+            label_dfs.append(pd.read_csv(os.path.join(dataset_path, Data.LABELS_DIRECTORY, file_name)))
+
+        arrays = {}
+
+        # numeric columns are stored as they are
+        data = pd.concat(data_dfs, ignore_index=True) if data_dfs else pd.DataFrame(columns=PackedDataset.DATA_COLUMN_ORDER)
+        for name, dtype in PackedDataset.NUMERIC_COLUMNS.items():
+            arrays[name] = data[name].to_numpy(dtype=dtype)
+
+        # string columns are replaced by codes into their vocabulary
+        labels = pd.concat(label_dfs, ignore_index=True) if label_dfs else pd.DataFrame(columns=PackedDataset.LABEL_COLUMNS)
+        for df, encoded_columns in [(data, PackedDataset.ENCODED_COLUMNS), (labels, dict.fromkeys(PackedDataset.LABEL_COLUMNS, np.int8))]:
+            for name, dtype in encoded_columns.items():
+                vocabulary, codes = np.unique(df[name].to_numpy(dtype=str), return_inverse=True)
+                arrays[name] = codes.astype(dtype)
+                arrays[f'{name}.vocabulary'] = vocabulary
+
+        # offsets of every scene, every frame and every scene's labels
+        scene_lengths = [len(df) for df in data_dfs]
+        frame_lengths = [np.unique(df['TIMESTAMP'].to_numpy(), return_counts=True)[1] for df in data_dfs]
+        arrays['scene_offsets'] = PackedDataset.offsets(scene_lengths)
+        arrays['scene_frame_offsets'] = PackedDataset.offsets([len(lengths) for lengths in frame_lengths])
+        arrays['frame_offsets'] = PackedDataset.offsets(np.concatenate(frame_lengths) if frame_lengths else [])
+        arrays['label_offsets'] = PackedDataset.offsets([len(df) for df in label_dfs])
+
+        meta = {'version': PackedDataset.FORMAT_VERSION, 'names': names, 'files': stats}
+
+        # write into a temporary directory and move it in place, so readers never see a half-written copy
+        packed_path = PackedDataset.packed_path(dataset_path)
+        temp_path = f'{packed_path}.tmp-{os.getpid()}'
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(temp_path, f'{name}.npy'), array)
+        with open(os.path.join(temp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(packed_path, ignore_errors=True)
+        try:
+            os.rename(temp_path, packed_path)
+        except OSError:
+            # another process packed the dataset at the same time, keep its copy
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+        # forget any copy of this dataset loaded before packing
+        for mmap in [True, False]:
+            PackedDataset.loaded.pop((os.path.abspath(dataset_path), mmap), None)
+
+    def offsets(lengths):
+        return np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).astype(np.int64)
+
+    ''' scene access '''
+
+    def rows(self, file_name):
+        '''Row range (start, end) of a scene'''
+        i = self.index[file_name]
+        return int(self.scene_offsets[i]), int(self.scene_offsets[i+1])
+
+    def frame_bounds(self, file_name):
+        '''Row offsets of each frame of a scene, relative to the first row of the scene'''
+        i = self.index[file_name]
+        start = self.scene_offsets[i]
+        return self.frame_offsets[self.scene_frame_offsets[i] : self.scene_frame_offsets[i+1]+1] - start
+
+    def label_rows(self, file_name):
+        '''Row range (start, end) of a scene's labels'''
+        i = self.index[file_name]
+        return int(self.label_offsets[i]), int(self.label_offsets[i+1])
+
+    def decode(self, name, codes):
+        return self.vocabularies[name][codes]
+
+    def scene_columns(self, file_name):
+        '''Maps each data column name to the rows of a scene (sorted by timestamp)
+
+        numeric columns are views into the (memory-mapped) packed arrays, nothing is copied
+        encoded columns are decoded into strings for the rows of this scene only
+        '''
+        start, end = self.rows(file_name)
+        columns = {}
+        for name in PackedDataset.DATA_COLUMN_ORDER:
+            column = self.columns[name][start:end]
+            columns[name] = self.decode(name, column) if name in PackedDataset.ENCODED_COLUMNS else column
+        return columns
+
+    def scene_labels(self, file_name):
+        '''Maps each label column name to the decoded labels of a scene'''
+        start, end = self.label_rows(file_name)
+        return {name: self.decode(name, self.labels[name][start:end]) for name in PackedDataset.LABEL_COLUMNS}
+
+    def __str__(self):
+        return f'PackedDataset({self.dataset_path}, {len(self.names)} scenes)'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+if __name__ == '__main__':
+    PackedDataset.pack(sys.argv[1] if len(sys.argv) > 1 else None)
+    print(PackedDataset.load(sys.argv[1] if len(sys.argv) > 1 else None))
@@ -19,6 +19,9 @@ p.draw_scene(s)
 p.draw_trajectories_of_scene(s, {'ego', '62', '63'})
 
 # show an inter
+
+# write the video of draw_scene_with_ego_traj into a file, without a window (see video.py)
+SceneVideo(s).save('0.gif')
 '''
 
 from matplotlib.animation import FuncAnimation
@@ -28,6 +31,8 @@ from .utils import Angle
 from .scene import Scene
 from .constants import SCENE_LENGTH
 from .agentfinder import AgentFinder
+from .cache import FeatureCache
+from .relations import Relations
 
 class Plot:
     def __init__(self, xmin, xmax, ymin, ymax, sz=6):
@@ -132,10 +137,19 @@ class Plot:
         return self
 
     
-    def draw_snapshot(self, agents: set):
+    def draw_snapshot(self, agents: set, ego=None):
+
+        # which agents are in front of ego, for all agents at once
+        agents = list(agents)
+        if ego is None:
+            ego = next((x for x in agents if x.id == 'ego'), None)
+        in_front = [False] * len(agents)
+        if ego is not None:
+            xs, ys = Relations.positions(agents)
+            in_front = Relations.in_front(xs, ys, ego.x, ego.y, ego.yaw)
 
         # for each agent
-        for agent in agents:
+        for agent, agent_in_front in zip(agents, in_front):
 
             # draw ego as red
             if agent.code == 'ego':
@@ -147,7 +161,7 @@ class Plot:
 
             # draw normal vehicles as light blue
             else:
-                if agent.is_in_front_of(next(x for x in agents if x.id == 'ego')): # agent is in front of ego
+                if agent_in_front: # agent is in front of ego
                     self.draw_agent(agent, '#1c99ec')
                 else:
                     self.draw_agent(agent, '#2bc793')
@@ -157,14 +171,22 @@ class Plot:
         return self
 
 
+    def draw_visible_snapshot(self, scene: Scene, ti):
+
+        # only draw agents inside the canvas
+        snapshot = scene.snapshot(ti)
+        visible = [snapshot[i] for i in scene.within_rect(ti, self.xmin, self.xmax, self.ymin, self.ymax).tolist()]
+
+        # colors still depend on ego, even if ego itself is outside the canvas
+        return self.draw_snapshot(visible, ego=scene.trajectories['ego'][ti])
+
+
     def draw_scene(self, scene: Scene, start_ti=0, end_ti=SCENE_LENGTH):
 
         def update(ti):
             self.redraw_canvas()
 
-            snapshot = scene.snapshot(start_ti+ti)
-
-            self.draw_snapshot(snapshot)
+            self.draw_visible_snapshot(scene, start_ti+ti)
             
         # Create the animation
         ani = FuncAnimation(
@@ -174,17 +196,16 @@ class Plot:
         return ani
     
 
-    def draw_scene_with_ego_traj(self, scene: Scene, start_ti=0, end_ti=SCENE_LENGTH, traj_length=40, firm_traj_length=0):
+    def draw_scene_with_ego_traj(self, scene: Scene, start_ti=0, end_ti=SCENE_LENGTH, traj_length=40, firm_traj_length=0, cache: FeatureCache = None):
 
-        finder = AgentFinder(scene)
+        # front tracks are looked up in the cache first if there is one
+        finder = AgentFinder(scene, cache)
 
         def update(dti):
             self.redraw_canvas()
 
             ti = start_ti + dti
 
-            snapshot = scene.snapshot(ti)
-            
             # draw trajectory from current ego to last known ego anchor
             self.draw_trajectory(scene.trajectories['ego'], ti, min(ti+traj_length, SCENE_LENGTH), color='#37d065')
 
@@ -196,10 +217,10 @@ class Plot:
             self.draw_trajectory(scene.trajectories['ego'], ti, ti+firm_traj_length, color='#447343')
 
             # draw the other agents
-            self.draw_snapshot(snapshot)
+            self.draw_visible_snapshot(scene, ti)
 
-            # mark the front agent as purple
-            front = finder.get_front(ti)
+            # mark the front agent as purple (the fronts of all frames are found once)
+            front = finder.get_fronts([ti])[0]
             if front is not None:
                 self.draw_agent(front, color='purple')
             
@@ -0,0 +1,47 @@
+'''
+Batched relations between agents and a reference pose
+
+Same relations as Agent.front_and_side_distance_relative_to, is_very_near, is_in_front_of and is_directly_in_front_of,
+but for many agents (xs, ys) at once, computed with a single rotation into the frame of the reference (x, y, yaw)
+
+x, y, yaw can be scalars (one reference, usually an ego anchor) or arrays that broadcast against xs, ys
+(e.g. a column of T ego anchors against a row of N agents gives T x N results)
+'''
+
+import numpy as np
+from .utils import Angle
+
+class Relations:
+    def positions(agents):
+        '''x and y arrays of a list of agents'''
+        return np.array([agent.x for agent in agents], dtype=float), np.array([agent.y for agent in agents], dtype=float)
+
+    def distances(xs, ys, x, y):
+        dx = xs - x
+        dy = ys - y
+        return np.sqrt(dx ** 2 + dy ** 2)
+
+    def front_and_side_distances(xs, ys, x, y, yaw):
+        '''Front, right is positive; back, left is negative'''
+        dx = xs - x
+        dy = ys - y
+        cos = Angle.cos(yaw)
+        sin = Angle.sin(yaw)
+        return dx * cos + dy * sin, dx * sin - dy * cos
+
+    def very_near(xs, ys, x, y, yaw):
+        '''Mask of agents that are very near the reference'''
+        front, side = Relations.front_and_side_distances(xs, ys, x, y, yaw)
+
+        # agents further than 4 are pruned (same as Agent.is_very_near)
+        return (Relations.distances(xs, ys, x, y) <= 4) & (np.abs(front) < 3.5) & (np.abs(side) < 1.5)
+
+    def in_front(xs, ys, x, y, yaw):
+        '''Mask of agents in front of the reference'''
+        front, side = Relations.front_and_side_distances(xs, ys, x, y, yaw)
+        return front > side ** 2
+
+    def directly_in_front(xs, ys, x, y, yaw):
+        '''Mask of agents directly in front of the reference'''
+        front, side = Relations.front_and_side_distances(xs, ys, x, y, yaw)
+        return (0 < front) & (front < 15) & (front > side ** 2 * 2)
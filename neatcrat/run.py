@@ -0,0 +1,151 @@
+'''
+Classifies every scene of the dataset in parallel
+
+`python -m neatcrat.run` shards all file names of the dataset across a process pool, every worker builds the scene and classifies it,
+and the results are streamed into one json lines file (one line per scene, in the order they finish) as they arrive
+
+A scene that fails (e.g. a NotImplementedError or an IndexError from Trajectory) is written with its error instead of labels,
+the rest of the run goes on
+
+Run `python -m neatcrat.run --help` for the options
+'''
+
+import argparse
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from .cache import FeatureCache
+from .classifier import SceneClassifier
+from .data import Data
+from .instrument import Instruments
+from .packed import PackedDataset
+from .scene import Scene
+from .store import SceneStore
+
+class CorpusRunner:
+
+    # where the results are written by default
+    OUTPUT_PATH = 'labels.jsonl'
+
+    # how many chunks each worker gets on average, more chunks balance better and fewer chunks cost less to schedule
+    CHUNKS_PER_WORKER = 8
+
+    # seconds between two progress reports
+    REPORT_INTERVAL = 5
+
+    def classify_file(file_name, dataset_path=None, instrument=False):
+        '''
+        Classifies one scene, returns a json-able result (with the error instead of labels if it fails)
+
+        with instrument, the result also holds the instruments report of the scene (see instrument.py), and the front
+        track cache is not used so that every front search is counted and timed
+        '''
+        start = time.perf_counter()
+        result = {'file_name': file_name}
+        if instrument:
+            Instruments.enable()
+        with Instruments.scene() if instrument else contextlib.nullcontext({}) as report:
+            try:
+                scene = Scene.from_data(Data(file_name, dataset_path))
+                cache = None if instrument else FeatureCache.shared(dataset_path)
+                result['labels'] = SceneClassifier(scene, cache).classify_scene()
+            except Exception as e:
+                result['error'] = f'{type(e).__name__}: {e}'
+        if instrument:
+            result['instruments'] = report
+        result['seconds'] = time.perf_counter() - start
+        return result
+
+    def run(file_names=None, output_path=OUTPUT_PATH, workers=None, chunk_size=None, dataset_path=None, report=sys.stderr, instrument_path=None, shared=False):
+        '''
+        Classifies the scenes (all of them by default) and writes one result per line into output_path
+
+        with instrument_path, the instruments report of the whole run is written into instrument_path.json and .folded
+        with shared, the workers read the dataset from one copy in shared memory (see store.py)
+        returns a summary of the run (counts, errors, and throughput)
+        '''
+        file_names = sorted(Data.file_names(dataset_path)[2] if file_names is None else file_names)
+        workers = workers or os.cpu_count() or 1
+        chunk_size = chunk_size or max(1, len(file_names) // (workers * CorpusRunner.CHUNKS_PER_WORKER))
+
+        # pack the dataset once before the workers start, so they only read it
+        PackedDataset.load(dataset_path)
+
+        classify = functools.partial(CorpusRunner.classify_file, dataset_path=dataset_path, instrument=instrument_path is not None)
+        totals = {'timings': {}, 'counters': {}}
+        summary = {'scenes': 0, 'frames': 0, 'errors': 0, 'seconds': 0.0}
+        start = last_report = time.perf_counter()
+
+        with open(output_path, 'w') as output:
+
+            def write(result):
+                output.write(json.dumps(result) + '\n')
+                # flush every result, so a run that is stopped keeps everything it finished
+                output.flush()
+
+                summary['scenes'] += 1
+                summary['frames'] += len(result.get('labels', []))
+                summary['errors'] += 'error' in result
+                if 'instruments' in result:
+                    Instruments.merge(result['instruments'], totals)
+
+            # a single worker runs in this process, which is easier to debug
+            store = None
+            if workers == 1:
+                results = map(classify, file_names)
+                pool = None
+            else:
+                if shared:
+                    store = SceneStore.create(dataset_path)
+                pool = store.pool(workers) if store is not None else multiprocessing.Pool(workers)
+                results = pool.imap_unordered(classify, file_names, chunksize=chunk_size)
+
+            try:
+                for result in results:
+                    write(result)
+                    now = time.perf_counter()
+                    if report is not None and now - last_report >= CorpusRunner.REPORT_INTERVAL:
+                        last_report = now
+                        print(CorpusRunner.progress(summary, len(file_names), now - start), file=report)
+            finally:
+                if pool is not None:
+                    pool.terminate()
+                if store is not None:
+                    store.close()
+                # a single worker enabled the instruments in this process
+                if instrument_path is not None:
+                    Instruments.disable()
+
+        summary['seconds'] = time.perf_counter() - start
+        if instrument_path is not None:
+            with open(f'{instrument_path}.json', 'w') as f:
+                json.dump(totals, f, indent=4)
+            with open(f'{instrument_path}.folded', 'w') as f:
+                f.write(Instruments.collapsed(totals) + '\n')
+        if report is not None:
+            print(CorpusRunner.progress(summary, len(file_names), summary['seconds']), file=report)
+        return summary
+
+    def progress(summary, total, seconds):
+        rate = summary['scenes'] / seconds if seconds > 0 else 0
+        frame_rate = summary['frames'] / seconds if seconds > 0 else 0
+        return f'{summary["scenes"]}/{total} scenes ({summary["errors"]} errors) in {seconds:.1f}s, {rate:.1f} scenes/s, {frame_rate:.0f} frames/s'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m neatcrat.run', description='Classifies every scene of the dataset in parallel')
+    parser.add_argument('file_names', nargs='*', help='scenes to classify (all of them by default)')
+    parser.add_argument('-o', '--output', default=CorpusRunner.OUTPUT_PATH, help='json lines file the results are written to')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes (all cpus by default)')
+    parser.add_argument('--chunk-size', type=int, default=None, help='scenes sent to a worker at a time')
+    parser.add_argument('--dataset', default='.', help='path that holds the dataset directory')
+    parser.add_argument('--instrument', default=None, metavar='PATH', help='time the pipeline, and write the report of the run into PATH.json and PATH.folded')
+    parser.add_argument('--shared-memory', action='store_true', help='load the dataset into shared memory once, for all the workers')
+    args = parser.parse_args()
+
+    CorpusRunner.run(args.file_names or None, args.output, args.workers, args.chunk_size, args.dataset, instrument_path=args.instrument, shared=args.shared_memory)
@@ -1,54 +1,97 @@
 '''
 Model of a scene (40-frame long video)
+
+Scene.from_data(data, lazy=True) opens a scene without doing work the caller may never need: the labels and the ego
+trajectory are ready at once, other trajectories are made (and their gaps interpolated) the first time they are asked for,
+and max_distance leaves out the agents that never come that close to ego
+(front agents are searched up to 40 frames along the ego path, so a max_distance below ~200 meters can change the labels)
 '''
 
-import pandas as pd
-from .agent import Agent
+from collections.abc import Mapping
+
+import numpy as np
+from .agent import Agent, AgentTable
 from .data import Data
+from .spatial import SpatialIndex
 from .trajectory import Trajectory
 from .constants import INVALID3, SCENE_LENGTH
 
 class Scene:
-    def __init__(self, dfs: list[pd.DataFrame], label_df: pd.DataFrame):
+    # csv columns an agent is made of
+    RAW_COLUMNS = ['TRACK_ID', 'OBJECT_TYPE', 'X', 'Y', 'V_X', 'V_Y', 'A_X', 'A_Y', 'YAW', 'DYAW']
+
+    def __init__(self, frames, labels, lazy=False, max_distance=None, rows=None):
+        # "frames" is a list of frames ordered by timestamp, each maps a csv column name to the agent rows at that time
+        # (dicts of numpy arrays from Data.frames(), or dataframes)
+        # "labels" maps first_class, second_class, and third_class to one label per timestamp index
+        # "lazy" makes the trajectories of agents other than ego on first use, "max_distance" drops the agents that are never
+        # closer to ego than it (None keeps them all)
+        # "rows" are (columns, timestamp indices) of all rows, used instead of joining the frames if they are already joined
+
+        # "...class" maps timestamp index to the classification result
+        self.first_class: dict[int, str] = {i: l for i, l in enumerate(labels['first_class'])}
+        self.second_class: dict[int, str] = {i: l for i, l in enumerate(labels['second_class'])}
+        self.third_class: dict[int, str] = {i: l for i, l in enumerate(labels['third_class'])}
 
-        # "trajectories" maps agent code to its trajectory
-        self.trajectories: dict[str, Trajectory] = {}
+        # all rows of the scene as one set of columns, with the timestamp index of every row
+        if rows is None:
+            columns = {name: np.concatenate([np.asarray(frame[name]) for frame in frames]) for name in Scene.RAW_COLUMNS}
+            tis = np.repeat(np.arange(len(frames)), [len(frame['TRACK_ID']) for frame in frames])
+        else:
+            columns, tis = rows
+
+        # "table" holds every agent of the scene, one slot per agent id (ordered by first appearance) and one column per timestamp index
+        self.table: AgentTable = AgentTable.fromRawColumns(columns, tis, SCENE_LENGTH)
+        if max_distance is not None:
+            self.table = self.table.taken(Scene.near_slots(self.table, max_distance))
+        self.lazy = lazy
+        self.max_distance = max_distance
+
+        # "trajectories" maps agent code to its trajectory (a slot of the table)
+        # agents that drop out of tracking for some frames are interpolated over the gap (as implied agents), in lazy scenes
+        # only when their trajectory is first asked for (or implied snapshots are)
+        if lazy:
+            # ego is made at once, every classifier needs it
+            self.trajectories: Mapping[str, Trajectory] = LazyTrajectories(self.table)
+            self.trajectories['ego']
+        else:
+            self.table.interpolate_gaps()
+            self.trajectories: dict[str, Trajectory] = {code: Trajectory.fromTable(self.table, slot) for slot, code in enumerate(self.table.codes)}
 
         # "snapshots" maps timestamp index to a list of agents in that time
+        # agents are views into the table, and a snapshot is only made the first time it is asked for
+        # "implied_snapshots" are the same, but also hold interpolated agents
         self.snapshots: dict[int, list[Agent]] = {}
+        self.implied_snapshots: dict[int, list[Agent]] = {}
 
-        # "...class" maps timestamp index to the classification result
-        self.first_class: dict[int, str] = {i: l for i, l in enumerate(label_df['first_class'])}
-        self.second_class: dict[int, str] = {i: l for i, l in enumerate(label_df['second_class'])}
-        self.third_class: dict[int, str] = {i: l for i, l in enumerate(label_df['third_class'])}
-
-        # make trajectories dictionary from raw dfs
-        for ti, df in enumerate(dfs):
-
-            # add all agents at this timestamp to their trajectories
-            for _, agent_row in df.iterrows():
-                agent: Agent = Agent.fromRawSeries(agent_row, implied=False)
-                if agent.code not in self.trajectories:
-                    self.trajectories[agent.code] = Trajectory(agent.id, agent.type)
-                self.trajectories[agent.code][ti] = agent
-        
-        # make snapshots from trajectories (currently without interpolation)
-        for ti in range(SCENE_LENGTH):
-            self.snapshots[ti] = []
-            for trajectory in self.trajectories.values():
-                # only insert known agents into snapshots
-                if ti in trajectory.agents:
-                    agent = trajectory[ti]
-                    if not agent.implied:
-                        self.snapshots[ti].append(trajectory[ti])
+        # "snapshot_indices" maps timestamp index to a spatial index of the agents in its snapshot, built on first use (large snapshots only)
+        self.snapshot_indices: dict[int, SpatialIndex] = {}
 
-            # sort agents from nearest to farthest from ego
-            # ego = self.trajectories['ego'][ti]
-            # self.snapshots[ti].sort(key=lambda agent: agent.distance_to(ego))
+        # "front_tracks" maps AgentFinder.front_track parameters to the front agents of every frame (see agentfinder.py)
+        self.front_tracks: dict[tuple, tuple] = {}
+
+        # "front_dvs" maps the same parameters to the velocity of every front agent relative to ego (see AgentFinder.front_dvs)
+        self.front_dvs: dict[tuple, np.ndarray] = {}
 
-    def from_data(data: Data):
+        # data file the scene was made from (None if it was not made from a file), front tracks are cached by its content
+        self.file_path: str = None
+
+    def from_data(data: Data, lazy=False, max_distance=None):
         # init wrapper to convert Data directly to Scene
-        return Scene(data.dfs, data.label_df)
+        # the rows of Data are already sorted by timestamp, so they are used as they are instead of split into frames
+        tis = np.repeat(np.arange(len(data.frame_bounds) - 1), np.diff(data.frame_bounds))
+        rows = {name: data.columns[name] for name in Scene.RAW_COLUMNS}, tis
+        scene = Scene(None, data.labels, lazy, max_distance, rows)
+        scene.file_path = data.file_path
+        return scene
+
+    def near_slots(table: AgentTable, max_distance):
+        '''Slots of the agents that are closer to ego than max_distance in some frame (and of ego), in table order'''
+        ego_slot = table.codes.index('ego')
+        distances = np.hypot(table.x - table.x[ego_slot], table.y - table.y[ego_slot])
+        near = (table.valid & table.valid[ego_slot] & (distances <= max_distance)).any(axis=1)
+        near[ego_slot] = True
+        return np.flatnonzero(near)
 
     def invalid(self):
         # every scene is invalid
@@ -72,10 +115,85 @@ class Scene:
         #             agent = trajectory[ti]
         #             if not agent.implied:
         #                 agents.add(agent)
-        return self.snapshots[ti]
+
+        # only insert known agents into snapshots, unless implied (interpolated) agents are asked for
+        snapshots = self.implied_snapshots if include_implied else self.snapshots
+        if ti not in snapshots:
+            if include_implied and self.lazy:
+                self.trajectories.interpolate_all()
+            snapshots[ti] = [self.table.agent(slot, ti) for slot in self.table.slots_at(ti, include_implied).tolist()]
+
+            # sort agents from nearest to farthest from ego
+            # ego = self.trajectories['ego'][ti]
+            # self.snapshots[ti].sort(key=lambda agent: agent.distance_to(ego))
+        return snapshots[ti]
     
+    def snapshot_index(self, ti) -> SpatialIndex:
+        # spatial index of snapshot(ti), query results are positions in the snapshot list
+        # None for snapshots smaller than SpatialIndex.MIN_AGENTS, their agents are scanned directly
+        if ti not in self.snapshot_indices:
+            slots = self.table.slots_at(ti)
+            if len(slots) < SpatialIndex.MIN_AGENTS:
+                return None
+            self.snapshot_indices[ti] = SpatialIndex(self.table.x[slots, ti], self.table.y[slots, ti])
+        return self.snapshot_indices[ti]
+
+    def within_rect(self, ti, xmin, xmax, ymin, ymax) -> np.ndarray:
+        '''Positions in snapshot(ti) of the agents strictly inside an axis-aligned rectangle'''
+        index = self.snapshot_index(ti)
+        if index is not None:
+            return index.within_rect(xmin, xmax, ymin, ymax)
+        slots = self.table.slots_at(ti)
+        xs, ys = self.table.x[slots, ti], self.table.y[slots, ti]
+        return np.flatnonzero((xmin < xs) & (xs < xmax) & (ymin < ys) & (ys < ymax))
+
     def __str__(self):
         return str(self.trajectories)
     
     def __repr__(self):
         return self.__str__()
+
+
+class LazyTrajectories(Mapping):
+    '''Maps agent code to its trajectory (a slot of the table), each trajectory is made the first time it is asked for'''
+
+    def __init__(self, table: AgentTable):
+        self.table = table
+        self.slots = {code: slot for slot, code in enumerate(table.codes)}
+
+        # trajectories made so far
+        self.made: dict[str, Trajectory] = {}
+
+        # whether every slot has been interpolated
+        self.interpolated = False
+
+    def __getitem__(self, code) -> Trajectory:
+        if code not in self.made:
+            slot = self.slots[code]
+            # only a slot with gaps changes the table, and only its filled rows of the polar fields are updated
+            if not self.interpolated:
+                self.table.interpolate_gaps([slot])
+            self.made[code] = Trajectory.fromTable(self.table, slot)
+        return self.made[code]
+
+    def interpolate_all(self):
+        # interpolating a slot again changes nothing, so the slots of trajectories that are already made can be included
+        if not self.interpolated:
+            self.table.interpolate_gaps()
+            self.interpolated = True
+
+    def __contains__(self, code):
+        # without making the trajectory
+        return code in self.slots
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __str__(self):
+        return f'LazyTrajectories({len(self.made)}/{len(self.slots)} made)'
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,119 @@
+'''
+Packed dataset in shared memory, for pools of worker processes
+
+SceneStore.create() copies every array of the packed dataset (see packed.py) into one multiprocessing.shared_memory
+block once, and store.handle is a small picklable description of it
+A worker calls SceneStore.attach(handle) (e.g. as the initializer of its pool), after which Data and Scene.from_data
+in that worker read the columns of a scene as views into the shared block: nothing is parsed or copied per worker,
+so memory stays flat as workers are added
+
+    with SceneStore.create() as store, store.pool(4) as pool:
+        labels = pool.map(classify, file_names)
+
+The block lives until the store that created it is closed (leaving the with block, or store.close())
+'''
+
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .packed import PackedDataset
+
+class SceneStore:
+
+    # every array starts at a multiple of this many bytes
+    ALIGNMENT = 64
+
+    # the store a worker attached to, kept so its block stays mapped
+    attached = None
+
+    def __init__(self, handle, shm: shared_memory.SharedMemory, owner=False):
+        # "handle" is what workers attach with: the block name, dataset path and meta, and where each array is in the block
+        self.handle: dict = handle
+        self.shm = shm
+        self.owner = owner
+        self.packed: PackedDataset = SceneStore.view(handle, shm)
+
+    def create(dataset_path=None):
+        '''Copies the packed dataset under dataset_path into a new shared memory block'''
+        packed = PackedDataset.load(dataset_path)
+        arrays = SceneStore.arrays(packed)
+
+        # lay the arrays out one after the other, aligned
+        layout = {}
+        size = 0
+        for key, array in arrays.items():
+            size = -(-size // SceneStore.ALIGNMENT) * SceneStore.ALIGNMENT
+            layout[key] = (size, array.dtype.str, array.shape)
+            size += array.nbytes
+
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for key, array in arrays.items():
+            offset, dtype, shape = layout[key]
+            np.ndarray(shape, dtype, shm.buf, offset)[...] = array
+
+        handle = {'name': shm.name, 'dataset_path': os.path.abspath(packed.dataset_path), 'meta': packed.meta, 'layout': layout}
+        return SceneStore(handle, shm, owner=True)
+
+    def attach(handle):
+        '''Makes Data of the store's dataset read from the shared block in this process'''
+        if SceneStore.attached is not None and SceneStore.attached.handle['name'] == handle['name']:
+            return SceneStore.attached
+        SceneStore.attached = SceneStore(handle, shared_memory.SharedMemory(handle['name']))
+        return SceneStore.attached
+
+    def arrays(packed: PackedDataset) -> dict[str, np.ndarray]:
+        '''Maps "group/name" to every array of a packed dataset'''
+        arrays = {}
+        for group, named in [('columns', packed.columns), ('labels', packed.labels), ('vocabularies', packed.vocabularies)]:
+            for name, array in named.items():
+                arrays[f'{group}/{name}'] = np.asarray(array)
+        for name in ['scene_offsets', 'scene_frame_offsets', 'frame_offsets', 'label_offsets']:
+            arrays[f'offsets/{name}'] = np.asarray(getattr(packed, name))
+        return arrays
+
+    def view(handle, shm) -> PackedDataset:
+        '''PackedDataset over the arrays of the block, registered as the loaded copy of its dataset'''
+        groups = {'columns': {}, 'labels': {}, 'vocabularies': {}, 'offsets': {}}
+        for key, (offset, dtype, shape) in handle['layout'].items():
+            group, name = key.split('/', 1)
+            array = np.ndarray(tuple(shape), dtype, shm.buf, offset)
+            array.flags.writeable = False
+            groups[group][name] = array
+
+        packed = PackedDataset(handle['dataset_path'], handle['meta'], groups['columns'], groups['labels'], groups['vocabularies'], groups['offsets'])
+        PackedDataset.loaded[handle['dataset_path'], True] = packed
+        return packed
+
+    def pool(self, workers=None):
+        '''Process pool whose workers are attached to this store'''
+        return multiprocessing.Pool(workers, initializer=SceneStore.attach, initargs=(self.handle,))
+
+    def close(self):
+        '''Forgets the shared copy in this process, and frees the block if this process created it'''
+        key = (self.handle['dataset_path'], True)
+        if PackedDataset.loaded.get(key) is self.packed:
+            del PackedDataset.loaded[key]
+        self.packed = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # views of the block are still in use (e.g. a Scene that is kept), it is unmapped when they are gone
+            pass
+        if self.owner:
+            self.shm.unlink()
+            self.owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __str__(self):
+        return f'SceneStore({self.handle["name"]}, {self.handle["dataset_path"]}, {self.shm.size / 2**20:.1f} MB)'
+
+    def __repr__(self):
+        return self.__str__()
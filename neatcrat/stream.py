@@ -0,0 +1,408 @@
+'''
+Classifies a live feed of frames, one timestamp at a time
+
+StreamingClassifier.push(frame, second_class) takes the agent rows of the next timestamp (same columns as Data.frame(ti))
+and the second class label of that frame, and returns the third class labels it set or revised, as (ti, label) pairs
+
+The front agent of a frame is found once the ego of the next LOOKAHEAD frames is known, the ego anchors after that are
+extrapolated (same model as Trajectory), then the same rules as SceneClassifier label the frame once the front of the next
+frame is known as well, so a frame gets its committed label LOOKAHEAD + 1 frames after it arrives
+Until then every push also labels the newer frames provisionally, as finish() would if the feed ended there (fronts from
+the ego extrapolated after the newest frame), so every frame has a label from the push it arrives with
+Provisional labels and cut in, cut out and crossing windows (which reach back up to the largest *_BACKWARD_DELTA frames)
+revise labels that were already given, labels of frames before final_until never change again
+
+Only the frames that can still change are kept, so the cost and memory of a push do not grow with the length of the feed
+With a lookahead of SCENE_LENGTH - 1, the labels of a 40-frame scene are the same as SceneClassifier.classify_scene,
+the default LOOKAHEAD of 4 commits labels sooner but extrapolates the ego earlier (about 84% of frames agree)
+'''
+
+from collections import deque
+
+import copy
+
+import numpy as np
+
+from .agentfinder import AgentFinder
+from .classifier import SceneClassifier
+from .constants import *
+from .relations import Relations
+from .spatial import SpatialIndex
+from .trajectory import Horizon, Trajectory
+from .utils import Angle, Coords
+
+class StreamingClassifier:
+
+    # frames of known ego after a frame before its front agent is found (SCENE_LENGTH - 1 gives SceneClassifier's labels)
+    LOOKAHEAD = 4
+
+    # ego anchors used to find the front agent, and the turning front agent (see AgentFinder.get_front, get_turning_front)
+    MAX_EXTRAPOLATION = 40
+
+    def __init__(self, lookahead=LOOKAHEAD, rules=SceneClassifier, turning_extrapolation_range=AgentFinder.TURNING_EXTRAPOLATION_RANGE, previews=True):
+        self.lookahead = lookahead
+        self.turning_extrapolation_range = turning_extrapolation_range
+
+        # whether push labels the frames that are not committed yet (without it, a frame is invalid until it is committed)
+        self.previews = previews
+
+        # thresholds of the section rules (SceneClassifier constants)
+        self.rules = rules
+        self.max_backward_delta = max(rules.CUTOUT_BACKWARD_DELTA, rules.CUTIN_BACKWARD_DELTA, rules.PEDESTRIANS_CROSS_BACKWARD_DELTA, rules.CROSS_BACKWARD_DELTA)
+
+        # number of frames pushed so far (the next frame's timestamp index)
+        self.n_frames = 0
+
+        # ego fields of the last frames (newest last), enough for the anchors of undecided frames and for extrapolation
+        self.ego = Trajectory('ego', OT_SELF)
+        self.ego_frames = deque(maxlen=lookahead + Trajectory.EXTRAPOLATION_RANGE + 1)
+
+        # frames whose front agent is not found yet, oldest first
+        self.undecided: deque[Snapshot] = deque()
+
+        # sections (runs of the same second class) that still have frames to visit, oldest first
+        self.sections: deque[Section] = deque()
+
+        # committed labels of the frames that can still change, by timestamp index
+        self.labels: dict[int, str] = {}
+
+        # labels of the frames that are not committed yet as finish() would set them, while they are previewed
+        self.provisional: dict[int, str] = None
+
+        # labels returned so far of the frames that can still change
+        self.reported: dict[int, str] = {}
+
+        # extrapolated ego after the newest frame, made on first use after each push
+        self.horizon: Horizon = None
+
+    ''' feed '''
+
+    def push(self, frame, second_class) -> list[tuple[int, str]]:
+        '''Adds the agent rows of the next timestamp, returns the (ti, label) pairs that were set or revised'''
+        ti = self.n_frames
+        snapshot = Snapshot(ti, frame)
+        self.n_frames += 1
+
+        # labels from here on are committed, until the preview
+        self.provisional = None
+
+        self.ego_frames.append(snapshot.ego_fields)
+        self.horizon = None
+        self.undecided.append(snapshot)
+
+        # a new second class closes the current section
+        if not self.sections or self.sections[-1].second_class != second_class or self.sections[-1].end is not None:
+            if self.sections:
+                self.sections[-1].close(ti)
+            self.sections.append(Section(self, ti, second_class))
+        self.sections[-1].arrive(ti)
+
+        # find the front agent of the frame that now has LOOKAHEAD frames of known ego after it
+        while self.undecided and self.undecided[0].ti + self.lookahead < self.n_frames:
+            self.decide(self.undecided.popleft(), self.sections)
+
+        if self.previews:
+            self.preview()
+        return self.flush_updates()
+
+    def finish(self) -> list[tuple[int, str]]:
+        '''Ends the feed: labels the remaining frames (with extrapolated ego), returns the (ti, label) pairs that were set or revised'''
+        self.provisional = None
+        if self.sections:
+            self.sections[-1].close(self.n_frames)
+        while self.undecided:
+            self.decide(self.undecided.popleft(), self.sections)
+        return self.flush_updates()
+
+    def preview(self):
+        '''Labels the frames that are not committed yet as finish() would now, on copies of the sections'''
+        self.provisional = {}
+        sections = [section.copy() for section in self.sections]
+        if sections:
+            sections[-1].close(self.n_frames)
+        for snapshot in self.undecided:
+            self.decide(snapshot, sections)
+
+    def classify_frames(frames, second_classes, lookahead=LOOKAHEAD, rules=SceneClassifier) -> list[str]:
+        '''Feeds all frames in order, returns the final label of each frame'''
+        # only the final labels are kept, so frames are not previewed
+        classifier = StreamingClassifier(lookahead, rules, previews=False)
+        labels = [INVALID3] * len(frames)
+        for frame, second_class in zip(frames, second_classes):
+            for ti, label in classifier.push(frame, second_class):
+                labels[ti] = label
+        for ti, label in classifier.finish():
+            labels[ti] = label
+        return labels
+
+    @property
+    def final_until(self):
+        '''Labels of frames before this timestamp index are final'''
+        return min([section.final_until() for section in self.sections], default=self.n_frames)
+
+    ''' labels '''
+
+    def write(self, ti, label):
+        if self.provisional is not None:
+            self.provisional[ti] = label
+        else:
+            self.labels[ti] = label
+
+    def flush_updates(self):
+        # a frame is labelled provisionally until its committed label is set
+        labels = {**self.labels, **(self.provisional or {})}
+        updates = sorted((ti, label) for ti, label in labels.items() if self.reported.get(ti) != label)
+        self.reported.update(updates)
+
+        # forget sections that are done and labels that cannot change anymore
+        while self.sections and self.sections[0].done():
+            self.sections.popleft()
+        final_until = self.final_until
+        for labels in [self.labels, self.reported]:
+            for ti in [ti for ti in labels if ti < final_until]:
+                del labels[ti]
+        return updates
+
+    ''' front agents '''
+
+    def ego_anchors(self, ti, n):
+        '''Poses (xs, ys, yaws) of ego at ti+1 ... ti+n, known ones first, then extrapolated from the newest frames'''
+        newest = self.n_frames - 1
+        known = [fields for fields in self.ego_frames if ti < fields['ti'] <= ti + n]
+
+        xs = [fields['x'] for fields in known]
+        ys = [fields['y'] for fields in known]
+        yaws = [fields['yaw'] for fields in known]
+
+        # frame j of the horizon is ego at newest + 1 + j
+        if ti + n > newest:
+            horizon = self.ego_horizon(ti + n - newest)
+            for field, values in [('x', xs), ('y', ys), ('yaw', yaws)]:
+                values.extend(getattr(horizon.table, field)[0, : ti + n - newest].tolist())
+        return np.array(xs, dtype=float), np.array(ys, dtype=float), np.array(yaws, dtype=float)
+
+    def ego_horizon(self, n) -> Horizon:
+        # n frames of ego extrapolated from the newest EXTRAPOLATION_RANGE frames (nearest first), like Trajectory.horizon
+        if self.horizon is None:
+            nearest = list(self.ego_frames)[::-1][:Trajectory.EXTRAPOLATION_RANGE]
+            window = {field: [fields[field] for fields in nearest] for field in Snapshot.FIELDS}
+            self.horizon = Horizon(self.ego, self.n_frames, 1, window)
+        self.horizon.extend(n)
+        return self.horizon
+
+    def decide(self, snapshot, sections):
+        '''Finds the front and turning front agents of a frame and hands them to its section (one of "sections")'''
+        ego = snapshot.ego_fields
+        fronts = []
+        for max_extrapolation, use_direct_front in [(self.MAX_EXTRAPOLATION, True), (self.turning_extrapolation_range, False)]:
+            anchor_xs, anchor_ys, anchor_yaws = self.ego_anchors(snapshot.ti, max(max_extrapolation - 1, 0))
+            i = AgentFinder.front_of(snapshot.xs, snapshot.ys, snapshot.not_ego, ego['x'], ego['y'], ego['yaw'], anchor_xs, anchor_ys, anchor_yaws, use_direct_front, snapshot.index)
+            fronts.append(None if i < 0 else snapshot.front(i))
+        front, turning_front = fronts
+
+        for section in sections:
+            if section.start <= snapshot.ti and (section.end is None or snapshot.ti < section.end):
+                section.decide(snapshot.ti, front, turning_front)
+                break
+
+
+class Snapshot:
+    '''Agent rows of one frame, as arrays'''
+
+    # agent fields kept for ego (same as AgentTable.FIELDS)
+    FIELDS = ['x', 'y', 'vx', 'vy', 'ax', 'ay', 'yaw', 'dyaw']
+
+    def __init__(self, ti, frame):
+        self.ti = ti
+        self.ids = np.asarray(frame['TRACK_ID'])
+        self.types = np.asarray(frame['OBJECT_TYPE'])
+        self.xs = np.asarray(frame['X'], dtype=float)
+        self.ys = np.asarray(frame['Y'], dtype=float)
+        self.yaws = Angle.normalize(np.asarray(frame['YAW'], dtype=float) + 90)
+        self.vrs, self.vthetas = Coords.polar(np.asarray(frame['V_X'], dtype=float), np.asarray(frame['V_Y'], dtype=float))
+
+        # ego is the agent whose code (the end of its id) is "ego", same as Scene.trajectories['ego']
+        self.not_ego = np.array([id.split('-')[-1] != 'ego' for id in self.ids.tolist()], dtype=bool)
+        if self.not_ego.all():
+            raise ValueError(f'Cannot find ego in frame {ti}')
+        e = int(np.argmin(self.not_ego))
+        fields = {'x': frame['X'], 'y': frame['Y'], 'vx': frame['V_X'], 'vy': frame['V_Y'], 'ax': frame['A_X'], 'ay': frame['A_Y'], 'dyaw': frame['DYAW']}
+        self.ego_fields = {field: float(np.asarray(values, dtype=float)[e]) for field, values in fields.items()}
+        self.ego_fields['yaw'] = float(self.yaws[e])
+        self.ego_fields['ti'] = ti
+        self.ego = e
+
+        # small frames are searched directly (see SpatialIndex.MIN_AGENTS)
+        self.index = SpatialIndex(self.xs, self.ys) if len(self.xs) >= SpatialIndex.MIN_AGENTS else None
+
+    def front(self, i):
+        '''What the section rules need to know about agent i as the front agent'''
+        e = self.ego
+        ego_yaw = self.yaws[e]
+
+        # same as Agent.front_velocity_relative_to and Agent.distance_to with ego
+        ego_v = self.vrs[e] * Angle.cos(Angle.normalize(self.vthetas[e] - ego_yaw))
+        front_v = self.vrs[i] * Angle.cos(Angle.normalize(self.vthetas[i] - ego_yaw))
+        return {
+            'id': self.ids[i],
+            'type': self.types[i],
+            'speed': abs(self.vrs[i]),
+            'dv': front_v - ego_v,
+            'distance': Relations.distances(self.xs[i], self.ys[i], self.xs[e], self.ys[e]),
+        }
+
+
+class Section:
+    '''
+    A run of frames with the same second class, labelled by the frame loop of the matching SceneClassifier section classifier
+
+    the loop visits frame i once the fronts of frames i and i+1 are known (or i is the last frame of the section)
+    '''
+
+    def __init__(self, stream: StreamingClassifier, start, second_class):
+        self.stream = stream
+        self.rules = stream.rules
+        self.start = start
+        self.second_class = second_class
+
+        # first frame after the section, None while it is still open
+        self.end = None
+
+        # (front, turning front) of decided frames that are not visited yet, by timestamp index
+        self.fronts: dict[int, tuple] = {}
+
+        # next frame the loop visits
+        self.next_visit = start
+
+        # window label that reaches frames that have not arrived yet: (label, last frame it covers)
+        self.pending_window = None
+
+    def copy(self):
+        '''Copy whose frame loop can go on without changing this section'''
+        section = copy.copy(self)
+        section.fronts = dict(self.fronts)
+        return section
+
+    def close(self, end):
+        self.end = end
+        self.pending_window = None
+        self.visit()
+
+    def arrive(self, ti):
+        # frames start invalid (or uturn), unless a window of an earlier frame already covers them
+        if self.second_class == UTURN:
+            self.stream.write(ti, UTURN_NOTHING_AHEAD)
+        elif self.pending_window is not None and ti <= self.pending_window[1]:
+            self.stream.write(ti, self.pending_window[0])
+        else:
+            self.stream.write(ti, INVALID3)
+
+    def decide(self, ti, front, turning_front):
+        # frames the loop skipped over are never visited
+        if ti >= self.next_visit:
+            self.fronts[ti] = (front, turning_front)
+            self.visit()
+
+    def done(self):
+        return self.end is not None and self.next_visit >= self.end
+
+    def final_until(self):
+        # frames before the next visit can only change through windows reaching back from it
+        return max(self.start, self.next_visit - self.stream.max_backward_delta)
+
+    def write_window(self, first, last, label):
+        # labels every frame from first to last that belongs to the section, frames that have not arrived are labelled when they do
+        newest = self.stream.n_frames - 1
+        end = self.end if self.end is not None else newest + 1
+        for ti in range(max(first, self.start), min(last + 1, end)):
+            self.stream.write(ti, label)
+        if self.end is None and last > newest:
+            self.pending_window = (label, last)
+
+    def visit(self):
+        '''Runs the section's frame loop as far as the known fronts allow'''
+        while self.next_visit in self.fronts:
+            i = self.next_visit
+            last = self.end is not None and i == self.end - 1
+            if not last and i + 1 not in self.fronts:
+                return
+
+            # next front is the front itself in the last frame of the section
+            fronts = self.fronts[i]
+            next_fronts = fronts if last else self.fronts[i + 1]
+
+            if self.second_class == INLANE: skip = self.visit_inlane(i, fronts[0], next_fronts[0])
+            elif self.second_class == WAIT: skip = self.visit_stop_and_wait(i, fronts[0])
+            elif self.second_class == STRAIGHT: skip = self.visit_crossing(i, fronts[1], next_fronts[1], STRAIGHT_NOTHING_AHEAD, STRAIGHT_HAS_LEAD, STRAIGHT_HAS_CROSS, skip=True)
+            elif self.second_class == LEFT: skip = self.visit_crossing(i, fronts[1], next_fronts[1], LEFT_NOTHING_AHEAD, LEFT_HAS_LEAD, LEFT_HAS_CROSS, skip=False)
+            elif self.second_class == RIGHT: skip = self.visit_crossing(i, fronts[1], next_fronts[1], RIGHT_NOTHING_AHEAD, RIGHT_HAS_LEAD, RIGHT_HAS_CROSS, skip=False)
+            else: skip = 0
+
+            # forget the fronts the loop has passed
+            self.next_visit = i + 1 + skip
+            for ti in range(i, self.next_visit):
+                self.fronts.pop(ti, None)
+
+    ''' frame rules, same as the section classifiers of SceneClassifier (return how many frames the loop skips) '''
+
+    def visit_inlane(self, i, front, next_front):
+        rules = self.rules
+
+        # nothing in front and nothing in next front (nothing ahead)
+        if front is None and next_front is None:
+            return 0
+
+        # same thing in front and next front (leading not changing in the next frame)
+        if front is not None and next_front is not None and front['id'] == next_front['id']:
+            if front['speed'] < rules.SMALL_VELOCITY_THRESHOLD: self.stream.write(i, INLANE_LEAD_STOPPED)
+            elif front['dv'] > rules.DV_THRESHOLD_FOR_ACCELERATION: self.stream.write(i, INLANE_LEAD_ACCELERATE)
+            elif front['dv'] < rules.DV_THRESHOLD_FOR_DECELERATION: self.stream.write(i, INLANE_LEAD_DECELERATE)
+            else: self.stream.write(i, INLANE_LEAD_CONST)
+            return 0
+
+        # no lead -> has lead => cutin, has lead -> no lead => cutout, lead further after lead change => prev lead cutout
+        if front is None:
+            cutout = False
+        elif next_front is None:
+            cutout = True
+        else:
+            cutout = next_front['distance'] > front['distance']
+
+        if cutout:
+            self.write_window(i - rules.CUTOUT_BACKWARD_DELTA, i + rules.CUTOUT_FORWARD_DELTA, INLANE_CUTOUT)
+            return rules.CUTOUT_FORWARD_DELTA
+        else:
+            self.write_window(i - rules.CUTIN_BACKWARD_DELTA, i + rules.CUTIN_FORWARD_DELTA, INLANE_CUTIN)
+            return rules.CUTIN_FORWARD_DELTA
+
+    def visit_stop_and_wait(self, i, front):
+        rules = self.rules
+
+        # nothing in front
+        if front is None:
+            return 0
+
+        # pedestrian or bike in front
+        if front['type'] in [OT_BIKE, OT_PEDESTRIAN]:
+            self.write_window(i - rules.PEDESTRIANS_CROSS_BACKWARD_DELTA, i + rules.PEDESTRIANS_CROSS_FORWARD_DELTA, WAIT_HAS_PEDESTRIANS)
+            return rules.PEDESTRIANS_CROSS_FORWARD_DELTA
+
+        # car in front
+        if front['type'] == OT_CAR:
+            self.stream.write(i, WAIT_HAS_LEAD)
+        return 0
+
+    def visit_crossing(self, i, front, next_front, nothing_ahead_label, lead_label, cross_label, skip):
+        # go straight skips the frames after a crossing, turn left and turn right do not (their loops are for loops)
+        delta = self.rules.CROSS_BACKWARD_DELTA
+
+        if front is None and next_front is None:
+            self.stream.write(i, nothing_ahead_label)
+            return 0
+
+        if front is not None and next_front is not None and front['id'] == next_front['id']:
+            self.stream.write(i, lead_label)
+            return 0
+
+        self.write_window(i - delta, i + delta, cross_label)
+        return delta if skip else 0
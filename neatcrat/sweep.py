@@ -0,0 +1,334 @@
+'''
+Sweeps the thresholds of SceneClassifier (and AgentFinder.TURNING_EXTRAPOLATION_RANGE) over a grid
+
+The expensive part of classifying a scene is finding the front agents, which does not depend on any threshold
+SceneFeatures holds everything the section classifiers read for every frame (front agents, their type, velocity, distance and
+velocity relative to ego) and is computed once per scene, then every combination of thresholds is classified from it at once:
+the section classifiers' frame loops run in lockstep for all combinations, as arrays with one row per combination
+
+Sweep.run(grid) does it for the whole dataset in parallel and returns one confusion matrix per combination (and the
+errors of the scenes it skipped),
+labels are the same as SceneClassifier's with the same thresholds
+
+Run `python -m neatcrat.sweep --help` for the options
+'''
+
+import argparse
+import functools
+import itertools
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from .agentfinder import AgentFinder
+from .cache import FeatureCache
+from .classifier import SceneClassifier
+from .constants import *
+from .data import Data
+from .evaluation import Evaluation
+from .packed import PackedDataset
+from .scene import Scene
+
+class SceneFeatures:
+    '''Per-frame features of a scene that the section classifiers read'''
+
+    def __init__(self, scene: Scene, turning_ranges, cache: FeatureCache = None):
+        finder = AgentFinder(scene, cache)
+        table = scene.table
+        frames = np.arange(SCENE_LENGTH)
+        ego_slot = scene.trajectories['ego'].slot
+
+        self.second_class: list[str] = [scene.second_class[ti] for ti in range(SCENE_LENGTH)]
+        self.third_class: np.ndarray = Evaluation.encode([scene.third_class[ti] for ti in range(SCENE_LENGTH)])
+
+        # front agent (as a table slot, -1 if there is none) of every frame and its distance to ego (nan if there is none)
+        self.front_slots, self.front_distances = finder.front_track()
+        has_front = self.front_slots >= 0
+        slots = np.where(has_front, self.front_slots, ego_slot)
+
+        # front type, same checks as the section classifiers
+        types = np.array(table.types, dtype=object)[slots]
+        self.front_is_person: np.ndarray = has_front & np.isin(types, [OT_BIKE, OT_PEDESTRIAN])
+        self.front_is_car: np.ndarray = has_front & (types == OT_CAR)
+
+        # front speed, and front velocity relative to ego velocity
+        self.front_speeds: np.ndarray = np.where(has_front, np.abs(table.vr[slots, frames]), np.nan)
+        self.front_dvs: np.ndarray = finder.front_dvs()
+
+        # turning front slots of every frame for every turning extrapolation range
+        self.turning_slots: dict[int, np.ndarray] = {r: finder.front_track(r, use_direct_front=False)[0] for r in turning_ranges}
+
+    def sections(self):
+        '''(first, end) frames of each run of the same second class, as SceneClassifier.classify_scene splits them'''
+        starts = [ti for ti in range(SCENE_LENGTH) if ti == 0 or self.second_class[ti] != self.second_class[ti-1]]
+        return list(zip(starts, starts[1:] + [SCENE_LENGTH]))
+
+
+class Sweep:
+
+    # thresholds that can be swept, SceneClassifier constants and AgentFinder.TURNING_EXTRAPOLATION_RANGE
+    # (CROSS_FORWARD_DELTA is not here because the section classifiers use CROSS_BACKWARD_DELTA on both sides)
+    PARAMETERS = [
+        'SMALL_VELOCITY_THRESHOLD',
+        'DV_THRESHOLD_FOR_ACCELERATION',
+        'DV_THRESHOLD_FOR_DECELERATION',
+        'CUTOUT_BACKWARD_DELTA',
+        'CUTOUT_FORWARD_DELTA',
+        'CUTIN_BACKWARD_DELTA',
+        'CUTIN_FORWARD_DELTA',
+        'PEDESTRIANS_CROSS_BACKWARD_DELTA',
+        'PEDESTRIANS_CROSS_FORWARD_DELTA',
+        'CROSS_BACKWARD_DELTA',
+        'TURNING_EXTRAPOLATION_RANGE',
+    ]
+
+    # how many chunks of scenes each worker gets on average
+    CHUNKS_PER_WORKER = 8
+
+    # confusion matrix row of each label
+    ROWS = Evaluation.ROWS
+
+    def default(parameter):
+        '''Current value of a parameter in SceneClassifier or AgentFinder'''
+        return getattr(AgentFinder if parameter == 'TURNING_EXTRAPOLATION_RANGE' else SceneClassifier, parameter)
+
+    def combinations(grid: dict[str, list]) -> dict[str, np.ndarray]:
+        '''
+        Every combination of the values in grid (parameter -> values), parameters not in grid keep their current value
+
+        returns one array per parameter, with the value of that parameter in each combination
+        '''
+        for parameter in grid:
+            if parameter not in Sweep.PARAMETERS:
+                raise ValueError(f'Cannot sweep {parameter}, it is not one of {Sweep.PARAMETERS}')
+        values = [list(grid.get(parameter, [Sweep.default(parameter)])) for parameter in Sweep.PARAMETERS]
+        product = list(itertools.product(*values))
+        return {parameter: np.array([combination[i] for combination in product]) for i, parameter in enumerate(Sweep.PARAMETERS)}
+
+    ''' classification of all combinations at once '''
+
+    def classify(features: SceneFeatures, combinations) -> np.ndarray:
+        '''Confusion matrix rows of the labels of every frame (one row per combination)'''
+        n_combinations = len(combinations['SMALL_VELOCITY_THRESHOLD'])
+        labels = np.full((n_combinations, SCENE_LENGTH), Sweep.ROWS[INVALID3])
+
+        # turning front of each frame for each combination
+        turning_slots = np.stack([features.turning_slots[r] for r in combinations['TURNING_EXTRAPOLATION_RANGE'].tolist()]) if n_combinations else None
+
+        for start, end in features.sections():
+            tis = np.arange(start, end)
+            second_class = features.second_class[start]
+
+            if second_class == INLANE: labels[:, tis] = Sweep.classify_inlane_section(features, combinations, tis)
+            elif second_class == WAIT: labels[:, tis] = Sweep.classify_stop_and_wait_section(features, combinations, tis)
+            elif second_class == STRAIGHT: labels[:, tis] = Sweep.classify_crossing_section(turning_slots[:, tis], combinations, STRAIGHT_NOTHING_AHEAD, STRAIGHT_HAS_LEAD, STRAIGHT_HAS_CROSS, skip=True)
+            elif second_class == LEFT: labels[:, tis] = Sweep.classify_crossing_section(turning_slots[:, tis], combinations, LEFT_NOTHING_AHEAD, LEFT_HAS_LEAD, LEFT_HAS_CROSS, skip=False)
+            elif second_class == RIGHT: labels[:, tis] = Sweep.classify_crossing_section(turning_slots[:, tis], combinations, RIGHT_NOTHING_AHEAD, RIGHT_HAS_LEAD, RIGHT_HAS_CROSS, skip=False)
+            elif second_class == UTURN: labels[:, tis] = Sweep.ROWS[UTURN_NOTHING_AHEAD]
+
+        return labels
+
+    def next_slots(slots):
+        # front of the next frame, the front itself for the last frame (works on the last axis)
+        return np.concatenate([slots[..., 1:], slots[..., -1:]], axis=-1)
+
+    def walk(labels, visit):
+        '''
+        Frame loop of a section classifier for all combinations in lockstep
+
+        visit(combinations, frames) labels the current frame of each given combination and returns how many frames each one skips
+        '''
+        n_combinations, n = labels.shape
+        i = np.full(n_combinations, -1)
+        while True:
+            i += 1
+            active = np.flatnonzero(i < n)
+            if len(active) == 0:
+                return labels
+            i[active] += visit(active, i[active])
+
+    def write_windows(labels, combinations, frames, backward, forward, label_rows):
+        # labels[c, frames-backward : frames+forward+1] = label_rows for each combination c (clipped to the section)
+        columns = np.arange(labels.shape[1])
+        windows = (columns >= (frames - backward)[:, None]) & (columns <= (frames + forward)[:, None])
+        labels[combinations] = np.where(windows, np.broadcast_to(label_rows, frames.shape)[:, None], labels[combinations])
+
+    def classify_inlane_section(features: SceneFeatures, combinations, tis):
+        '''Same rules as SceneClassifier.classify_inlane_section'''
+        rows = Sweep.ROWS
+        slots = features.front_slots[tis]
+        next_slots = Sweep.next_slots(slots)
+        distances = features.front_distances[tis]
+        next_distances = Sweep.next_slots(distances)
+
+        nothing_ahead = (slots < 0) & (next_slots < 0)
+        same_lead = (slots >= 0) & (slots == next_slots)
+
+        # when the lead changes: no lead -> has lead is a cutin, has lead -> no lead is a cutout,
+        # otherwise it is a cutout if the next lead is further away
+        cutout = (slots >= 0) & ((next_slots < 0) | (next_distances > distances))
+
+        # label of each frame with a constant lead, for every combination
+        speeds, dvs = features.front_speeds[tis], features.front_dvs[tis]
+        lead_labels = np.where(
+            speeds < combinations['SMALL_VELOCITY_THRESHOLD'][:, None], rows[INLANE_LEAD_STOPPED], np.where(
+            dvs > combinations['DV_THRESHOLD_FOR_ACCELERATION'][:, None], rows[INLANE_LEAD_ACCELERATE], np.where(
+            dvs < combinations['DV_THRESHOLD_FOR_DECELERATION'][:, None], rows[INLANE_LEAD_DECELERATE], rows[INLANE_LEAD_CONST])))
+
+        labels = np.full((len(lead_labels), len(tis)), rows[INVALID3])
+
+        def visit(cs, frames):
+            skips = np.zeros(len(cs), dtype=int)
+
+            lead = same_lead[frames]
+            labels[cs[lead], frames[lead]] = lead_labels[cs[lead], frames[lead]]
+
+            change = ~lead & ~nothing_ahead[frames]
+            if change.any():
+                cs, frames = cs[change], frames[change]
+                out = cutout[frames]
+                backward = np.where(out, combinations['CUTOUT_BACKWARD_DELTA'][cs], combinations['CUTIN_BACKWARD_DELTA'][cs])
+                forward = np.where(out, combinations['CUTOUT_FORWARD_DELTA'][cs], combinations['CUTIN_FORWARD_DELTA'][cs])
+                Sweep.write_windows(labels, cs, frames, backward, forward, np.where(out, rows[INLANE_CUTOUT], rows[INLANE_CUTIN]))
+                skips[change] = forward
+            return skips
+
+        return Sweep.walk(labels, visit)
+
+    def classify_stop_and_wait_section(features: SceneFeatures, combinations, tis):
+        '''Same rules as SceneClassifier.classify_stop_and_wait_section'''
+        rows = Sweep.ROWS
+        is_person, is_car = features.front_is_person[tis], features.front_is_car[tis]
+        labels = np.full((len(combinations['SMALL_VELOCITY_THRESHOLD']), len(tis)), rows[INVALID3])
+
+        def visit(cs, frames):
+            skips = np.zeros(len(cs), dtype=int)
+
+            car = is_car[frames]
+            labels[cs[car], frames[car]] = rows[WAIT_HAS_LEAD]
+
+            person = is_person[frames]
+            if person.any():
+                cs, frames = cs[person], frames[person]
+                forward = combinations['PEDESTRIANS_CROSS_FORWARD_DELTA'][cs]
+                Sweep.write_windows(labels, cs, frames, combinations['PEDESTRIANS_CROSS_BACKWARD_DELTA'][cs], forward, rows[WAIT_HAS_PEDESTRIANS])
+                skips[person] = forward
+            return skips
+
+        return Sweep.walk(labels, visit)
+
+    def classify_crossing_section(slots, combinations, nothing_ahead_label, lead_label, cross_label, skip):
+        '''
+        Same rules as SceneClassifier.classify_go_straight_section (skip=True), classify_turn_left_section and classify_turn_right_section
+        (skip=False, their for loops do not skip the frames after a crossing)
+
+        slots are the turning fronts of the section's frames for each combination
+        '''
+        rows = Sweep.ROWS
+        next_slots = Sweep.next_slots(slots)
+        nothing_ahead = (slots < 0) & (next_slots < 0)
+        same_lead = (slots >= 0) & (slots == next_slots)
+        labels = np.full(slots.shape, rows[INVALID3])
+
+        def visit(cs, frames):
+            skips = np.zeros(len(cs), dtype=int)
+
+            labels[cs, frames] = np.where(nothing_ahead[cs, frames], rows[nothing_ahead_label], rows[lead_label])
+
+            change = ~nothing_ahead[cs, frames] & ~same_lead[cs, frames]
+            if change.any():
+                cs, frames = cs[change], frames[change]
+                delta = combinations['CROSS_BACKWARD_DELTA'][cs]
+                Sweep.write_windows(labels, cs, frames, delta, delta, rows[cross_label])
+                if skip:
+                    skips[change] = delta
+            return skips
+
+        return Sweep.walk(labels, visit)
+
+    ''' sweeping the dataset '''
+
+    def sweep_files(file_names, combinations, dataset_path=None):
+        '''Sums the confusion matrices of every combination over some scenes, returns (confusions, scenes, errors)'''
+        n = len(Evaluation.CLASS_NAMES)
+        n_combinations = len(combinations['SMALL_VELOCITY_THRESHOLD'])
+        turning_ranges = np.unique(combinations['TURNING_EXTRAPOLATION_RANGE']).tolist()
+
+        confusions = np.zeros(n_combinations * n * n, dtype=np.int64)
+        scenes, errors = 0, []
+        for file_name in file_names:
+            try:
+                features = SceneFeatures(Scene.from_data(Data(file_name, dataset_path)), turning_ranges, FeatureCache.shared(dataset_path))
+            except Exception as e:
+                errors.append(f'{file_name}: {type(e).__name__}: {e}')
+                continue
+            labels = Sweep.classify(features, combinations)
+
+            # one bincount over (combination, true, predicted) of every frame
+            keys = (np.arange(n_combinations)[:, None] * n + features.third_class) * n + labels
+            confusions += np.bincount(keys.ravel(), minlength=len(confusions))
+            scenes += 1
+        return confusions.reshape(n_combinations, n, n), scenes, errors
+
+    def run(grid, file_names=None, workers=None, dataset_path=None):
+        '''
+        Classifies the scenes (all of them by default) with every combination of the values in grid
+
+        returns the combinations, one Evaluation per combination, and the errors of the scenes that were skipped
+        '''
+        combinations = Sweep.combinations(grid)
+        file_names = sorted(Data.file_names(dataset_path)[2] if file_names is None else file_names)
+        workers = workers or os.cpu_count() or 1
+
+        # pack the dataset once before the workers start
+        PackedDataset.load(dataset_path)
+
+        n_chunks = min(len(file_names), workers * Sweep.CHUNKS_PER_WORKER) or 1
+        chunks = [file_names[i::n_chunks] for i in range(n_chunks)]
+        sweep = functools.partial(Sweep.sweep_files, combinations=combinations, dataset_path=dataset_path)
+
+        if workers == 1:
+            results = list(map(sweep, chunks))
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.map(sweep, chunks, chunksize=1)
+
+        confusions = sum(confusion for confusion, _, _ in results)
+        errors = [error for _, _, chunk_errors in results for error in chunk_errors]
+        return combinations, [Evaluation(confusion) for confusion in confusions], errors
+
+    def report(combinations, evaluations, top=10):
+        '''Table of the swept parameters of the best combinations (by accuracy), with their accuracy and macro F1'''
+        swept = [parameter for parameter, values in combinations.items() if len(np.unique(values)) > 1]
+        order = sorted(range(len(evaluations)), key=lambda c: -evaluations[c].accuracy)[:top]
+
+        lines = ['  '.join([*swept, 'accuracy', 'macro_f1'])]
+        for c in order:
+            values = [f'{combinations[parameter][c]:>{len(parameter)}}' for parameter in swept]
+            lines.append('  '.join([*values, f'{evaluations[c].accuracy:>8.4f}', f'{evaluations[c].macro_f1:>8.4f}']))
+        return '\n'.join(lines)
+
+
+def parse_grid(items):
+    # "PARAMETER=v1,v2,..." -> {PARAMETER: [v1, v2, ...]}
+    grid = {}
+    for item in items:
+        parameter, values = item.split('=')
+        grid[parameter] = [float(value) if '.' in value else int(value) for value in values.split(',')]
+    return grid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m neatcrat.sweep', description='Sweeps the thresholds of SceneClassifier over a grid')
+    parser.add_argument('grid', nargs='+', help=f'PARAMETER=v1,v2,... for any of {", ".join(Sweep.PARAMETERS)}')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes (all cpus by default)')
+    parser.add_argument('--top', type=int, default=10, help='number of best combinations to show')
+    parser.add_argument('--dataset', default='.', help='path that holds the dataset directory')
+    args = parser.parse_args()
+
+    combinations, evaluations, errors = Sweep.run(parse_grid(args.grid), workers=args.workers, dataset_path=args.dataset)
+    for error in errors:
+        print(f'skipped {error}', file=sys.stderr)
+    print(Sweep.report(combinations, evaluations, args.top))
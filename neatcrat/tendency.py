@@ -0,0 +1,115 @@
+'''
+Lead, cross and align tendencies of every agent, scored for whole scenes at once
+
+The Gaussian-kernel scores of previous_reference/cratutils (calc_lead_tendency, calc_cross_tendency, calc_align_tendency)
+over the rows of a Features matrix:
+    lead: a vehicle close ahead of ego, heading the way ego heads and in the direction ego moves
+    cross: an agent close to ego, heading and moving across ego's way
+    align: an agent close to ego, heading and moving the way ego does
+
+Angles are compared in radians, wrapped to [-pi, pi), so the sigmas below are in radians (cratutils compared degrees
+with the same sigmas, and its lead tendency compared the type code with 'Vehicle', which made it always 0)
+
+Tendency.scene(features, file_name) is a (frames x agents) score matrix of a scene, and Tendency.top(scores, k) the k
+best agents of every frame, e.g.
+    tracks, scores = Tendency.scene(Features.load(), '1.csv', 'lead')
+    agents, best = Tendency.top(scores, 3)
+    tracks[agents[:, 0]]  # most likely lead vehicle of every frame (where best[:, 0] > 0)
+'''
+
+import numpy as np
+
+from .constants import OBJECT_TYPES, OT_CAR
+from .features import Features
+from .utils import Angle
+
+class Tendency:
+
+    # kernel widths of the scores, angles in radians and distances (or speeds) in meters (per second)
+    SIGMA_ALIGN = 0.08
+    SIGMA_CROSS = 0.5
+    SIGMA_CLOSE = 25
+
+    KINDS = ['lead', 'cross', 'align']
+
+    ''' kernels '''
+
+    def kernel(x, sigma):
+        '''N(0, sigma) scaled to 1 at 0'''
+        return np.exp(-x**2 / (2 * sigma * sigma))
+
+    def difference(theta1, theta2):
+        '''theta1 - theta2 in radians, wrapped to [-pi, pi)'''
+        return (np.asarray(theta1) - theta2 + np.pi) % (2 * np.pi) - np.pi
+
+    def how_aligned(theta1, theta2, sigma=SIGMA_ALIGN):
+        '''How close two angles (in radians) are'''
+        return Tendency.kernel(Tendency.difference(theta1, theta2), sigma)
+
+    def how_crossed(theta1, theta2, sigma=SIGMA_CROSS):
+        '''How perpendicular two angles (in radians) are'''
+        return Tendency.kernel(np.pi/2 - np.abs(Tendency.difference(theta1, theta2)), sigma)
+
+    def how_close(distance, sigma=SIGMA_CLOSE):
+        '''How close a distance is to 0'''
+        return Tendency.kernel(distance, sigma)
+
+    ''' tendencies '''
+
+    def of_rows(matrix, ego_vtheta, kind='lead') -> np.ndarray:
+        '''Tendency of every row of a Features matrix, ego_vtheta is the vtheta (in degrees) of the ego of each row'''
+        column = lambda name: matrix[:, Features.COLUMNS[name]]
+        yaw, theta, vtheta, ego_vtheta = (Angle.rad(angles) for angles in [column('yaw'), column('theta'), column('vtheta'), ego_vtheta])
+        distance = Tendency.how_close(column('r'))
+
+        if kind == 'lead':
+            chasing = Tendency.how_aligned(0, yaw) + Tendency.how_aligned(ego_vtheta, theta) + Tendency.how_aligned(0, theta)
+            return distance * chasing * (column('type') == OBJECT_TYPES[OT_CAR])
+        if kind == 'cross':
+            across = Tendency.how_crossed(ego_vtheta, vtheta) * Tendency.how_crossed(0, yaw) * Tendency.how_crossed(0, vtheta)
+            return distance * across * (1 - Tendency.how_close(column('vx')))
+        if kind == 'align':
+            return distance * Tendency.how_aligned(0, yaw) * Tendency.how_aligned(ego_vtheta, vtheta)
+        raise ValueError(f'Unknown tendency {kind}, expected one of {Tendency.KINDS}')
+
+    def of_features(features: Features, kind='lead') -> np.ndarray:
+        '''Tendency of every row of the feature matrix, 0 for the ego rows'''
+        ego_rows = features.ego_rows()
+        frames = np.repeat(np.arange(len(ego_rows)), np.diff(features.frame_offsets))
+        ego_vtheta = features.matrix[ego_rows[frames], Features.COLUMNS['vtheta']]
+
+        scores = Tendency.of_rows(features.matrix, ego_vtheta, kind)
+        scores[ego_rows[ego_rows >= 0]] = 0
+        return scores
+
+    def scene(features: Features, file_name, kind='lead'):
+        '''
+        (TRACK_IDs, scores) of the agents of a scene other than ego
+        scores[f, a] is the tendency of agent tracks[a] in frame f of features.frames(file_name), 0 where it is not in the frame
+        '''
+        matrix, frame_offsets = features.scene(file_name)
+        start, end = features.scene_rows(file_name)
+        tracks = features.tracks[start:end]
+        frames = np.repeat(np.arange(len(frame_offsets) - 1), np.diff(frame_offsets))
+
+        is_ego = np.isin(tracks, np.flatnonzero(features.track_names == 'ego'))
+        ego_vtheta = np.zeros(len(frame_offsets) - 1)
+        ego_vtheta[frames[is_ego]] = matrix[is_ego, Features.COLUMNS['vtheta']]
+
+        agents = ~is_ego
+        codes, columns = np.unique(tracks[agents], return_inverse=True)
+        scores = np.zeros((len(frame_offsets) - 1, len(codes)))
+        scores[frames[agents], columns] = Tendency.of_rows(matrix[agents], ego_vtheta[frames[agents]], kind)
+        return features.track_names[codes], scores
+
+    def top(scores, k=1):
+        '''(agents, scores) of the k highest scores of every frame, best first, agent -1 where there are fewer than k scored agents'''
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return np.zeros((len(scores), 0), dtype=np.int64), np.zeros((len(scores), 0))
+        agents = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best = np.take_along_axis(scores, agents, axis=1)
+        order = np.argsort(-best, axis=1, kind='stable')
+        agents, best = np.take_along_axis(agents, order, axis=1), np.take_along_axis(best, order, axis=1)
+        agents[best <= 0] = -1
+        return agents, best
@@ -0,0 +1,165 @@
+'''
+Fixed-width training tensors of the whole dataset, for the models of previous_reference
+
+Built from Features (the rows ProcessVideos keeps) in one pass and written as .npy files, so a training job only memory-maps them:
+    rnn_x (scenes, SCENE_LENGTH, agents, RNN_FEATURES): the agents of every frame in their order in the frame, zero padded
+    rnn_mask (scenes, SCENE_LENGTH, agents): True where rnn_x holds an agent
+    rnn_y (scenes, SCENE_LENGTH): third class of every frame, -1 for the frames Features leaves out
+    tree_x (frames, TREE_AGENTS * agent features + 2): the TREE_AGENTS agents of largest |x| in every frame and the
+        first and second classes, one row per frame that has that many agents (GetXYFromVideosForTree)
+    tree_y (frames,): third class of every tree_x row
+    tree_frames (frames, 2): scene index and frame number of every tree_x row
+meta.json holds the scene names and the column names, and is written last
+
+Run `python -m neatcrat.tensors dataset/tensors` to export them, and load them with Tensors.load('dataset/tensors')
+'''
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from .constants import SCENE_LENGTH
+from .features import Features
+
+class Tensors:
+
+    # features of every agent of the rnn tensor (everything but the label, as GetXFromVideosForRNN)
+    RNN_FEATURES = [name for name in Features.FEATURES if name != 'third_class']
+
+    # agents of every tree row and the features of each one (everything but the classes, and |x|)
+    TREE_AGENTS = 2
+    TREE_AGENT_FEATURES = [name for name in Features.FEATURES if name not in Features.LABEL_CODES] + ['absx']
+
+    # dtype of the feature tensors
+    DTYPE = np.float32
+
+    def array(directory, name, shape, dtype, fill=0):
+        '''An array filled with fill, memory-mapped to directory/name.npy unless directory is None'''
+        if directory is None:
+            return np.full(shape, fill, dtype=dtype)
+        array = np.lib.format.open_memmap(os.path.join(directory, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+        array[...] = fill
+        return array
+
+    def layout(features: Features):
+        '''(frame, scene, slot in its frame) of every row of the feature matrix'''
+        n_frames = len(features.frame_offsets) - 1
+        frames = np.repeat(np.arange(n_frames), np.diff(features.frame_offsets))
+        frame_scenes = np.searchsorted(features.scene_offsets, np.arange(n_frames), side='right') - 1
+        slots = np.arange(len(features.matrix)) - features.frame_offsets[frames]
+        return frames, frame_scenes[frames], slots
+
+    ''' tensors '''
+
+    def rnn(features: Features, max_agents=None, directory=None):
+        '''(x, mask, y) padded to max_agents per frame (the most agents of any frame by default, later agents are cut)'''
+        frames, scenes, slots = Tensors.layout(features)
+        frame_lengths = np.diff(features.frame_offsets)
+        if max_agents is None:
+            max_agents = int(frame_lengths.max(initial=0))
+
+        shape = (len(features.names), SCENE_LENGTH, max_agents)
+        x = Tensors.array(directory, 'rnn_x', (*shape, len(Tensors.RNN_FEATURES)), Tensors.DTYPE)
+        mask = Tensors.array(directory, 'rnn_mask', shape, bool, False)
+        y = Tensors.array(directory, 'rnn_y', shape[:2], np.int8, -1)
+
+        rows = np.flatnonzero(slots < max_agents)
+        tis = features.frame_numbers[frames[rows]]
+        columns = [Features.COLUMNS[name] for name in Tensors.RNN_FEATURES]
+        x[scenes[rows], tis, slots[rows]] = features.matrix[rows][:, columns]
+        mask[scenes[rows], tis, slots[rows]] = True
+
+        # every row of a frame has the labels of the frame
+        first_rows = features.frame_offsets[:-1][frame_lengths > 0]
+        y[scenes[first_rows], features.frame_numbers[frames[first_rows]]] = features.matrix[first_rows, Features.COLUMNS['third_class']]
+        return x, mask, y
+
+    def tree(features: Features, agents=TREE_AGENTS, directory=None):
+        '''(x, y, frames) of every frame with at least "agents" agents'''
+        frames, scenes, _ = Tensors.layout(features)
+        frame_lengths = np.diff(features.frame_offsets)
+        matrix = features.matrix
+        absx = np.abs(matrix[:, Features.COLUMNS['x']])
+
+        # rows sorted by frame, then by |x| from the largest, and their rank within the frame
+        order = np.lexsort((-absx, frames))
+        ranks = np.arange(len(order)) - features.frame_offsets[frames[order]]
+
+        kept_frames = np.flatnonzero(frame_lengths >= agents)
+        positions = np.full(len(frame_lengths), -1)
+        positions[kept_frames] = np.arange(len(kept_frames))
+
+        chosen = (ranks < agents) & (positions[frames[order]] >= 0)
+        top, top_ranks = order[chosen], ranks[chosen]
+
+        n_features = len(Tensors.TREE_AGENT_FEATURES)
+        x = Tensors.array(directory, 'tree_x', (len(kept_frames), agents * n_features + 2), Tensors.DTYPE)
+        y = Tensors.array(directory, 'tree_y', (len(kept_frames),), np.int8, -1)
+        tree_frames = Tensors.array(directory, 'tree_frames', (len(kept_frames), 2), np.int32)
+
+        columns = [Features.COLUMNS[name] for name in Tensors.TREE_AGENT_FEATURES[:-1]]
+        agent_features = np.column_stack([matrix[top][:, columns], absx[top]])
+        for rank in range(agents):
+            chosen = top_ranks == rank
+            x[positions[frames[top[chosen]]], rank * n_features : (rank + 1) * n_features] = agent_features[chosen]
+
+        first_rows = features.frame_offsets[kept_frames]
+        x[:, -2] = matrix[first_rows, Features.COLUMNS['first_class']]
+        x[:, -1] = matrix[first_rows, Features.COLUMNS['second_class']]
+        y[:] = matrix[first_rows, Features.COLUMNS['third_class']]
+        tree_frames[:, 0] = scenes[first_rows]
+        tree_frames[:, 1] = features.frame_numbers[kept_frames]
+        return x, y, tree_frames
+
+    def tree_columns(agents=TREE_AGENTS):
+        '''Names of the tree_x columns'''
+        return [f'{name}_dist_{i}' for i in range(agents) for name in Tensors.TREE_AGENT_FEATURES] + ['first_class', 'second_class']
+
+    ''' files '''
+
+    def export(features: Features, directory, max_agents=None, tree_agents=TREE_AGENTS):
+        '''Writes every tensor into directory'''
+        os.makedirs(directory, exist_ok=True)
+
+        # a directory without meta.json is incomplete
+        meta_path = os.path.join(directory, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        x, mask, y = Tensors.rnn(features, max_agents, directory)
+        tree_x, tree_y, tree_frames = Tensors.tree(features, tree_agents, directory)
+        for array in [x, mask, y, tree_x, tree_y, tree_frames]:
+            array.flush()
+
+        meta = {
+            'names': features.names,
+            'rnn_features': Tensors.RNN_FEATURES,
+            'tree_columns': Tensors.tree_columns(tree_agents),
+            'shapes': {'rnn_x': list(x.shape), 'tree_x': list(tree_x.shape)},
+        }
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        return meta
+
+    def load(directory, mmap=True):
+        '''(meta, arrays) of an exported directory, arrays maps the name of every tensor to its (memory-mapped) array'''
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        names = ['rnn_x', 'rnn_mask', 'rnn_y', 'tree_x', 'tree_y', 'tree_frames']
+        return meta, {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None) for name in names}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m neatcrat.tensors', description='Exports the training tensors of the whole dataset')
+    parser.add_argument('output_directory', help='directory the .npy files are written into')
+    parser.add_argument('--agents', type=int, default=None, help='agents per frame of the rnn tensor (the most of any frame by default)')
+    parser.add_argument('--tree-agents', type=int, default=Tensors.TREE_AGENTS, help='agents per row of the tree table')
+    parser.add_argument('--all-agents', action='store_true', help='keep every agent, not only the valuable ones')
+    parser.add_argument('--dataset', default='.', help='path that holds the dataset directory')
+    args = parser.parse_args()
+
+    meta = Tensors.export(Features.load(args.dataset, not args.all_agents), args.output_directory, args.agents, args.tree_agents)
+    print(f'rnn_x {tuple(meta["shapes"]["rnn_x"])}, tree_x {tuple(meta["shapes"]["tree_x"])} written into {args.output_directory}', file=sys.stderr)
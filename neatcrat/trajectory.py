@@ -3,116 +3,271 @@ Model for an agent trajectory
 
 List of ti -> agents, but able to extrapolate
 
-TODO(MID-PRIORITY) ADD RECURSIVE VALIDATION FOR EXTRAPOLATION INSTEAD OF ALLOWING STACK OVERFLOW WHEN THERE IS NOT ENOUGH AGENTS
+Agents after the last (or before the first) known agent are extrapolated iteratively, one frame after another,
+into a Horizon that keeps them, so asking for a far away agent (e.g. trajectory[200]) never recurses
+A trajectory is extrapolated at most MAX_HORIZON frames past its known agents
 
-TODO(MID-PRIORITY) ADD "EXTRAPOLATE WITHIN"
+Agents missing between two known agents are interpolated (see AgentTable.interpolate_gaps)
 
 TODO(LOW-PRIORITY) ADD (DETERMINISTIC) NOISE TO EXTRAPOLATION RESULTS TO WEAKEN EXPONENTIAL TRENDS
 '''
 
+import numpy as np
+
 from .constants import SCENE_LENGTH, SECONDS_PER_FRAME
-from .agent import Agent
+from .agent import Agent, AgentTable
+from .instrument import Instruments
 from .utils import Numbers
 
 class Trajectory:
     EXTRAPOLATION_RANGE = 8
     MOMENTUM_FACTOR = 0 # how much next delta depend on previous deltas
 
-    def __init__(self, id, type, agents=None):
+    # furthest an agent is extrapolated from the known agents (in frames), bounds the memory of a horizon
+    MAX_HORIZON = 1000
+
+    def __init__(self, id, type, agents=None, table: AgentTable = None, slot=None):
         self.id = id
         self.type = type
-        self.agents: dict[int, Agent] = {} if agents is None else agents.copy() # maps timestamp index to agent
-    
+
+        # known agents of a trajectory in a scene live in a slot of the scene's agent table
+        self.table = table
+        self.slot = slot
+
+        # maps timestamp index to agents that are not in the table (set directly)
+        self.agents: dict[int, Agent] = {} if agents is None else agents.copy()
+
+        # maps a direction (1 after the known agents, -1 before them) to the horizon of extrapolated agents
+        self.horizons: dict[int, Horizon] = {}
+
+        # (first, last) timestamp index of the known agents, found on first use
+        self._bounds = None
+
+    def fromTable(table: AgentTable, slot):
+        return Trajectory(table.ids[slot], table.types[slot], table=table, slot=slot)
+
+    def known(self, ti):
+        '''Whether the table holds the agent at this timestamp index'''
+        return self.table is not None and 0 <= ti < self.table.valid.shape[1] and self.table.valid[self.slot, ti]
+
+    def has(self, ti):
+        '''Whether the agent at this timestamp index is known (not extrapolated)'''
+        return ti in self.agents or self.known(ti)
+
+    def bounds(self):
+        '''First and last timestamp index of the known agents'''
+        if self._bounds is None:
+            tis = list(self.agents)
+            if self.table is not None:
+                known = np.flatnonzero(self.table.valid[self.slot])
+                if len(known):
+                    tis += [known[0], known[-1]]
+            if not tis:
+                raise IndexError(f'Cannot extrapolate {self.id} because it has no known agents')
+            self._bounds = int(min(tis)), int(max(tis))
+        return self._bounds
+
     def __setitem__(self, ti, agent):
         self.agents[ti] = agent
-    
+
+        # the extrapolated agents may depend on the replaced agent
+        self.horizons = {}
+        self._bounds = None
+
     def __getitem__(self, ti):
         if isinstance(ti, slice):
             return [self[i] for i in range(ti.start, ti.stop)]
-        
+
         elif isinstance(ti, int):
             if ti in self.agents:
                 return self.agents[ti]
-            if ti < 0:
-                extrapolated_agent = self._extrapolate_back(ti)
-            elif ti >= SCENE_LENGTH:
-                extrapolated_agent = self._extrapolate_front(ti)
+            if self.known(ti):
+                return self.table.agent(self.slot, ti)
+
+            first, last = self.bounds()
+            if ti < first:
+                return self._extrapolate_back(ti)
+            elif ti > last:
+                return self._extrapolate_front(ti)
             else:
-                extrapolated_agent = self._extrapolate_within(ti)
-        
-            # cache the extrapolated agent
-            self.agents[ti] = extrapolated_agent
+                return self._extrapolate_within(ti)
 
-            return extrapolated_agent
-    
-    def _extrapolate_back(self, ti):
+    def poses(self, start, end):
+        '''x, y and yaw arrays of the agents from start to end (extrapolated where needed)'''
+        if start >= end:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+
+        # extrapolate the whole range first
+        first, last = self.bounds()
+        if end - 1 > last:
+            self[end - 1]
+        if start < first:
+            self[start]
 
-        # get next agents, closest in the front
-        next_agents = [self[temp_ti] for temp_ti in range(ti+1, ti+1+Trajectory.EXTRAPOLATION_RANGE)]
-        # self[ti+1 : ti+1+Trajectory.EXTRAPOLATION_RANGE]
+        # agents set directly or missing within the known range are gathered one by one
+        if self.agents or self.table is None or not self.table.valid[self.slot, max(start, first) : min(end, last + 1)].all():
+            agents = self[start:end]
+            return (
+                np.array([agent.x for agent in agents], dtype=float),
+                np.array([agent.y for agent in agents], dtype=float),
+                np.array([agent.yaw for agent in agents], dtype=float),
+            )
 
-        # value = nearest value + backward delta [approx]= nearest value - weighted average of nearest forward deltas
-        dyaw = next_agents[0].dyaw - Numbers.weighted_avg(Numbers.deltas(map(lambda agent: agent.dyaw, next_agents))) * self.MOMENTUM_FACTOR
-        ax = next_agents[0].ax - Numbers.weighted_avg(Numbers.deltas(map(lambda agent: agent.ax, next_agents))) * self.MOMENTUM_FACTOR
-        ay = next_agents[0].ay - Numbers.weighted_avg(Numbers.deltas(map(lambda agent: agent.ay, next_agents))) * self.MOMENTUM_FACTOR
+        return tuple(self._field_range(field, start, end, first, last) for field in ['x', 'y', 'yaw'])
 
-        # # yawi = yawf - dyaw * t
-        # yaw = next_agents[0].yaw - Numbers.weighted_avg([dyaw, next_agents[0].dyaw]) * SECONDS_PER_FRAME
+    def _field_range(self, field, start, end, first, last):
+        # values of a field from start to end, read from the past horizon, the table and the future horizon
+        parts = []
+        if start < first:
+            # frame j of the past horizon is timestamp index first - 1 - j
+            parts.append(getattr(self.horizons[-1].table, field)[0, first - min(end, first) : first - start][::-1])
+        if start <= last and end > first:
+            parts.append(getattr(self.table, field)[self.slot, max(start, first) : min(end, last + 1)])
+        if end > last + 1:
+            # frame j of the future horizon is timestamp index last + 1 + j
+            parts.append(getattr(self.horizons[1].table, field)[0, max(start, last + 1) - last - 1 : end - last - 1])
+        return np.concatenate(parts)
 
-        # # vi = vf - a * t
-        # vx = next_agents[0].vx - Numbers.weighted_avg([ax, next_agents[0].ax]) * SECONDS_PER_FRAME
-        # vy = next_agents[0].vy - Numbers.weighted_avg([ay, next_agents[0].ay]) * SECONDS_PER_FRAME
+    def horizon(self, direction):
+        '''Horizon of agents extrapolated after (direction 1) or before (direction -1) the known agents'''
+        if direction not in self.horizons:
+            first, last = self.bounds()
+            origin = last + 1 if direction == 1 else first - 1
 
-        yaw = Numbers.weighted_avg(map(lambda agent: agent.yaw, next_agents), weight_decay=0.8)
-        vx = Numbers.weighted_avg(map(lambda agent: agent.vx, next_agents), weight_decay=0.8)
-        vy = Numbers.weighted_avg(map(lambda agent: agent.vy, next_agents), weight_decay=0.8)
+            # start from the nearest known agents, up to EXTRAPOLATION_RANGE of them and without crossing a gap
+            tis = []
+            ti = origin - direction
+            while len(tis) < Trajectory.EXTRAPOLATION_RANGE and self.has(ti):
+                tis.append(ti)
+                ti -= direction
+            window = {field: [float(getattr(self[ti], field)) for ti in tis] for field in AgentTable.FIELDS}
 
-        # xi = xf - v * t
-        x = next_agents[0].x - Numbers.weighted_avg([vx, next_agents[0].vx]) * SECONDS_PER_FRAME
-        y = next_agents[0].y - Numbers.weighted_avg([vy, next_agents[0].vy]) * SECONDS_PER_FRAME
+            self.horizons[direction] = Horizon(self, origin, direction, window)
+        return self.horizons[direction]
 
-        return Agent(self.id, self.type, x, y, vx, vy, ax, ay, yaw, dyaw, implied=True)
+    def _extrapolate_back(self, ti):
+        horizon = self.horizon(-1)
+        return horizon.agent(horizon.origin - ti)
 
     def _extrapolate_front(self, ti):
-        
-        # get previous agents, closest in the front
-        prev_agents = [self[temp_ti] for temp_ti in range(ti-1, ti-1-Trajectory.EXTRAPOLATION_RANGE, -1)]
+        horizon = self.horizon(1)
+        return horizon.agent(ti - horizon.origin)
+
+    def _extrapolate(self, window, direction):
+        '''
+        Agent fields extrapolated from the fields of the nearest agents (window, nearest first),
+        one frame after them when direction is 1 and one frame before them when direction is -1
+        '''
+        agent = {}
 
-        # value = nearest value + forward delta [approx]= nearest value + weighted average of forward deltas
-        dyaw = prev_agents[0].dyaw + Numbers.weighted_avg(Numbers.deltas(map(lambda agent: agent.dyaw, prev_agents))) * self.MOMENTUM_FACTOR
-        ax = prev_agents[0].ax + Numbers.weighted_avg(Numbers.deltas(map(lambda agent: agent.ax, prev_agents))) * self.MOMENTUM_FACTOR
-        ay = prev_agents[0].ay + Numbers.weighted_avg(Numbers.deltas(map(lambda agent: agent.ay, prev_agents))) * self.MOMENTUM_FACTOR
+        # value = nearest value + forward delta [approx]= nearest value + weighted average of nearest deltas
+        # (backwards, the weighted average of nearest deltas is subtracted)
+        for field in ['dyaw', 'ax', 'ay']:
+            deltas = Numbers.deltas(window[field])
+            momentum = Numbers.weighted_avg(deltas) * self.MOMENTUM_FACTOR if deltas else 0
+            agent[field] = window[field][0] + direction * momentum
 
         # # yawf = yawi + dyaw * t
-        # yaw = prev_agents[0].yaw + Numbers.weighted_avg([dyaw, prev_agents[0].dyaw]) * SECONDS_PER_FRAME
+        # yaw = window['yaw'][0] + direction * Numbers.weighted_avg([dyaw, window['dyaw'][0]]) * SECONDS_PER_FRAME
 
         # # vf = vi + a * t
-        # vx = prev_agents[0].vx + Numbers.weighted_avg([ax, prev_agents[0].ax]) * SECONDS_PER_FRAME
-        # vy = prev_agents[0].vy + Numbers.weighted_avg([ay, prev_agents[0].ay]) * SECONDS_PER_FRAME
+        # vx = window['vx'][0] + direction * Numbers.weighted_avg([ax, window['ax'][0]]) * SECONDS_PER_FRAME
+        # vy = window['vy'][0] + direction * Numbers.weighted_avg([ay, window['ay'][0]]) * SECONDS_PER_FRAME
 
-        yaw = Numbers.weighted_avg(map(lambda agent: agent.yaw, prev_agents), weight_decay=0.8)
-        vx = Numbers.weighted_avg(map(lambda agent: agent.vx, prev_agents), weight_decay=0.8)
-        vy = Numbers.weighted_avg(map(lambda agent: agent.vy, prev_agents), weight_decay=0.8)
+        for field in ['yaw', 'vx', 'vy']:
+            agent[field] = Numbers.weighted_avg(window[field], weight_decay=0.8)
 
-        # # xf = xi + v * t
-        x = prev_agents[0].x + Numbers.weighted_avg([vx, prev_agents[0].vx]) * SECONDS_PER_FRAME
-        y = prev_agents[0].y + Numbers.weighted_avg([vy, prev_agents[0].vy]) * SECONDS_PER_FRAME
+        # xf = xi + v * t
+        agent['x'] = window['x'][0] + direction * (Numbers.weighted_avg([agent['vx'], window['vx'][0]]) * SECONDS_PER_FRAME)
+        agent['y'] = window['y'][0] + direction * (Numbers.weighted_avg([agent['vy'], window['vy'][0]]) * SECONDS_PER_FRAME)
 
-        return Agent(self.id, self.type, x, y, vx, vy, ax, ay, yaw, dyaw, implied=True)
+        return agent
 
     def _extrapolate_within(self, ti):
-        raise NotImplementedError(f'Had to extrapolate_within for {self.id} at {ti}')
-        # print(f'Had to extrapolate_within for {self.id} at {ti}')
-        # return Agent(self.id, self.type, 5, 5, 5, 5, 5, 5, 5, 5, implied=True)
+        # gaps between known agents are interpolated when the scene is made (lazy scenes do it when the trajectory is first used)
+        if self.table is not None and 0 <= ti < self.table.valid.shape[1]:
+            self.table.interpolate_gaps([self.slot])
+            if self.known(ti):
+                return self.table.agent(self.slot, ti)
+        raise IndexError(f'Cannot interpolate {self.id} at {ti}, it is not between two agents of its table')
 
     def __str__(self):
         s = 'Trajectory(\n'
         s += f'ID={self.id}\n'
         s += f'TYPE={self.type}\n'
-        for ti, agent in self.agents.items():
+        known = {ti: self.table.agent(self.slot, ti) for ti in range(self.table.valid.shape[1]) if self.known(ti)} if self.table is not None else {}
+        extrapolated = {horizon.origin + j * horizon.direction: horizon.agent(j) for horizon in self.horizons.values() for j in range(horizon.filled)}
+        for ti, agent in sorted({**extrapolated, **known, **self.agents}.items()):
             s += f'{ti}: {str(agent)}\n'
         s += ')'
         return s
-    
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class Horizon:
+    '''
+    Agents extrapolated past one end of a trajectory, in a one-slot AgentTable
+
+    frame j of the table is the agent at timestamp index origin + j * direction
+    agents are extrapolated in order, each from the EXTRAPOLATION_RANGE agents nearer to the known ones
+    '''
+
+    def __init__(self, trajectory: Trajectory, origin, direction, window):
+        self.trajectory = trajectory
+        self.origin = origin
+        self.direction = direction
+
+        # maps each agent field to its values in the nearest agents (nearest first), the next agent is extrapolated from them
+        self.window: dict[str, list[float]] = window
+
+        self.table = AgentTable([trajectory.id], [trajectory.type], 0)
+        self.filled = 0
+
+    def agent(self, j) -> Agent:
+        '''The j-th extrapolated agent (counting from the known agents)'''
+        if j >= self.filled:
+            self.extend(j + 1)
+        return self.table.agent(0, j)
+
+    def extend(self, n):
+        '''Extrapolates agents until the horizon holds n of them'''
+        if n <= self.filled:
+            return
+        if n > Trajectory.MAX_HORIZON:
+            raise IndexError(f'Cannot extrapolate {self.trajectory.id} {n} frames away from its known agents (at most {Trajectory.MAX_HORIZON})')
+        if not self.window['x']:
+            raise IndexError(f'Cannot extrapolate {self.trajectory.id} because it has no known agents next to {self.origin}')
+
+        # grow the table geometrically, so extending one frame at a time stays linear
+        capacity = self.table.valid.shape[1]
+        if n > capacity:
+            self.table = self.table.resized(min(Trajectory.MAX_HORIZON, max(n, 2 * capacity, SCENE_LENGTH)))
+
+        if Instruments.enabled:
+            Instruments.count('extrapolated agents', n - self.filled)
+
+        values = {field: [] for field in AgentTable.FIELDS}
+        for _ in range(self.filled, n):
+            agent = self.trajectory._extrapolate(self.window, self.direction)
+            for field in AgentTable.FIELDS:
+                values[field].append(agent[field])
+
+                # slide the window onto the new agent
+                window = self.window[field]
+                window.insert(0, agent[field])
+                del window[Trajectory.EXTRAPOLATION_RANGE:]
+
+        for field in AgentTable.FIELDS:
+            getattr(self.table, field)[0, self.filled:n] = values[field]
+        self.table.valid[0, self.filled:n] = True
+        self.table.implied[0, self.filled:n] = True
+        self.table.polar = None
+        self.filled = n
+
+    def __str__(self):
+        return f'Horizon({self.trajectory.id}, {self.filled} agents from {self.origin} in direction {self.direction})'
+
     def __repr__(self):
         return self.__str__()
@@ -0,0 +1,276 @@
+'''
+Headless export of scene videos (what Plot.draw_scene_with_ego_traj shows) to GIF or MP4 files
+
+SceneVideo(scene).save('0.gif') renders off-screen with Agg, without pyplot or a window:
+the axes, grid and ticks are drawn once and kept as the background, and every frame only updates a fixed set of artists
+(one collection of arrows, one of squares, and a pool of texts) and blits them over the background
+
+GIF files are written with Pillow, MP4 files need ffmpeg on the PATH
+
+Run `python -m neatcrat.video videos` to export every scene of the dataset in parallel (see --help for the options)
+'''
+
+import argparse
+import functools
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
+
+from .agentfinder import AgentFinder
+from .cache import FeatureCache
+from .constants import OT_CAR, SCENE_LENGTH
+from .data import Data
+from .relations import Relations
+from .scene import Scene
+from .utils import Angle
+
+class SceneVideo:
+
+    # canvas (same as the example in plot.py), figure size in inches, and resolution
+    LIMITS = (-30, 30, -50, 300)
+    SIZE = 6
+    DPI = 100
+
+    # frames per second (Plot animations show a frame every 200 ms)
+    FPS = 5
+
+    # agents are drawn as in Plot.draw_agent: an arrow along the yaw, a square, and the agent code
+    ARROW_LENGTH = 15
+    ARROW_HEAD_WIDTH = 1
+    ARROW_HEAD_LENGTH = 2
+    SQUARE_SIZE = 13
+
+    # colors of Plot.draw_scene_with_ego_traj and Plot.draw_snapshot
+    TRAJECTORY_COLOR = '#37d065'
+    EXTRAPOLATED_COLOR = '#fd842e'
+    FIRM_TRAJECTORY_COLOR = '#447343'
+    EGO_COLOR = '#f63c5b'
+    NOT_VEHICLE_COLOR = '#c3d4d9'
+    IN_FRONT_COLOR = '#1c99ec'
+    VEHICLE_COLOR = '#2bc793'
+    FRONT_COLOR = 'purple'
+
+    def __init__(self, scene: Scene, start_ti=0, end_ti=SCENE_LENGTH, traj_length=40, firm_traj_length=0, limits=LIMITS, size=SIZE, dpi=DPI, cache: FeatureCache = None):
+        self.scene = scene
+        self.tis = range(start_ti, end_ti)
+        self.traj_length = traj_length
+        self.firm_traj_length = firm_traj_length
+        self.xmin, self.xmax, self.ymin, self.ymax = limits
+
+        # front tracks are looked up in the cache first if there is one
+        self.finder = AgentFinder(scene, cache)
+
+        # a figure of its own with an Agg canvas, so nothing touches the pyplot backend
+        self.fig = Figure(figsize=(size, size), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self.draw_background()
+
+    def draw_background(self):
+        # same axes as Plot.redraw_canvas, drawn once
+        ax = self.ax
+        ax.set_xlim(self.xmin, self.xmax)
+        ax.set_ylim(self.ymin, self.ymax)
+        ax.axhline(0, color='gray', linewidth=0.8)
+        ax.axvline(0, color='gray', linewidth=0.8)
+        ax.grid(visible=True, which='both', linestyle='--', linewidth=0.5, color='lightgray')
+        step_size = 10
+        ax.set_xticks(range(self.xmin, self.xmax+1, step_size))
+        ax.set_yticks(range(self.ymin, self.ymax+1, step_size))
+
+        # animated artists are left out of the background, and drawn over it every frame
+        self.arrows = PolyCollection([], linewidths=1, animated=True)
+        self.squares = ax.scatter([], [], marker='s', s=SceneVideo.SQUARE_SIZE ** 2, facecolors='white', linewidths=1, animated=True)
+        ax.add_collection(self.arrows)
+        self.texts = []
+
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    ''' frames '''
+
+    def items(self, ti):
+        '''(xs, ys, yaws, codes, colors) of everything drawn in a frame, in drawing order'''
+        parts = []
+        ego = self.scene.trajectories['ego']
+
+        def add(xs, ys, yaws, codes, colors):
+            parts.append((xs, ys, yaws, list(codes), list(colors)))
+
+        def add_trajectory(start, end, color):
+            xs, ys, yaws = ego.poses(start, end)
+            add(xs, ys, yaws, ['ego'] * len(xs), [color] * len(xs))
+
+        # ego trajectory up to the last known ego, then the extrapolated part of it, then its "firm" part
+        add_trajectory(ti, min(ti + self.traj_length, SCENE_LENGTH), SceneVideo.TRAJECTORY_COLOR)
+        if ti + self.traj_length > SCENE_LENGTH:
+            add_trajectory(SCENE_LENGTH, ti + self.traj_length, SceneVideo.EXTRAPOLATED_COLOR)
+        add_trajectory(ti, ti + self.firm_traj_length, SceneVideo.FIRM_TRAJECTORY_COLOR)
+
+        # the agents inside the canvas (same colors as Plot.draw_snapshot)
+        table = self.scene.table
+        slots = table.slots_at(ti)[self.scene.within_rect(ti, self.xmin, self.xmax, self.ymin, self.ymax)]
+        xs, ys = table.x[slots, ti], table.y[slots, ti]
+        ego_agent = ego[ti]
+        in_front = Relations.in_front(xs, ys, ego_agent.x, ego_agent.y, ego_agent.yaw)
+        codes = [table.codes[slot] for slot in slots.tolist()]
+        colors = [
+            SceneVideo.EGO_COLOR if code == 'ego'
+            else SceneVideo.NOT_VEHICLE_COLOR if table.types[slot] != OT_CAR
+            else SceneVideo.IN_FRONT_COLOR if agent_in_front
+            else SceneVideo.VEHICLE_COLOR
+            for slot, code, agent_in_front in zip(slots.tolist(), codes, in_front.tolist())
+        ]
+        add(xs, ys, table.yaw[slots, ti], codes, colors)
+
+        # the front agent (the fronts of all frames are found once)
+        front_slots, _ = self.finder.front_track()
+        slot = front_slots[ti]
+        if slot >= 0:
+            add(table.x[[slot], ti], table.y[[slot], ti], table.yaw[[slot], ti], [table.codes[slot]], [SceneVideo.FRONT_COLOR])
+
+        xs, ys, yaws = (np.concatenate([part[i] for part in parts]) for i in range(3))
+        codes = [code for part in parts for code in part[3]]
+        colors = [color for part in parts for color in part[4]]
+
+        # agents on or outside the border of the canvas are not drawn (same as Plot.draw_agent)
+        inside = (self.xmin < xs) & (xs < self.xmax) & (self.ymin < ys) & (ys < self.ymax)
+        kept = np.flatnonzero(inside).tolist()
+        return xs[inside], ys[inside], yaws[inside], [codes[i] for i in kept], [colors[i] for i in kept]
+
+    def arrow_polygons(xs, ys, yaws):
+        '''Outlines of the arrows of Plot.draw_agent (ax.arrow with its default width), one (7, 2) array per agent'''
+        length, head_width, head_length = SceneVideo.ARROW_LENGTH, SceneVideo.ARROW_HEAD_WIDTH, SceneVideo.ARROW_HEAD_LENGTH
+        width = 0.001
+        outline = np.array([
+            [0, width / 2], [length, width / 2], [length, head_width / 2], [length + head_length, 0],
+            [length, -head_width / 2], [length, -width / 2], [0, -width / 2],
+        ])
+        cos, sin = Angle.cos(yaws)[:, None], Angle.sin(yaws)[:, None]
+        return np.stack([xs[:, None] + outline[:, 0] * cos - outline[:, 1] * sin, ys[:, None] + outline[:, 0] * sin + outline[:, 1] * cos], axis=-1)
+
+    def render(self, ti) -> np.ndarray:
+        '''RGBA pixels of a frame'''
+        xs, ys, yaws, codes, colors = self.items(ti)
+
+        self.arrows.set_verts(list(SceneVideo.arrow_polygons(xs, ys, yaws)))
+        self.arrows.set_facecolor(colors)
+        self.arrows.set_edgecolor(colors)
+        self.squares.set_offsets(np.column_stack([xs, ys]))
+        self.squares.set_edgecolor(colors)
+
+        # texts are made once and reused, frames with fewer agents hide the rest
+        while len(self.texts) < len(codes):
+            self.texts.append(self.ax.text(0, 0, '', ha='center', va='center', fontsize=8, animated=True))
+        for text, x, y, code, color in zip(self.texts, xs.tolist(), ys.tolist(), codes, colors):
+            text.set_position((x, y))
+            text.set_text(code)
+            text.set_color(color)
+
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.arrows)
+        self.ax.draw_artist(self.squares)
+        for text in self.texts[:len(codes)]:
+            self.ax.draw_artist(text)
+        return np.asarray(self.canvas.buffer_rgba()).copy()
+
+    def frames(self):
+        for ti in self.tis:
+            yield self.render(ti)
+
+    ''' files '''
+
+    def save(self, path, fps=FPS):
+        '''Writes the video into a .gif or .mp4 file'''
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.gif':
+            SceneVideo.write_gif(path, self.frames(), fps)
+        elif extension == '.mp4':
+            SceneVideo.write_mp4(path, self.frames(), fps)
+        else:
+            raise ValueError(f'Cannot write a video into {path}, only .gif and .mp4 files are supported')
+
+    def write_gif(path, frames, fps):
+        from PIL import Image
+
+        # frames are quantized to a palette one by one with the fast octree method, which is ~3x faster than letting save() do it
+        images = [Image.fromarray(frame[:, :, :3]).quantize(method=Image.Quantize.FASTOCTREE) for frame in frames]
+        images[0].save(path, save_all=True, append_images=images[1:], duration=round(1000 / fps), loop=0)
+
+    def write_mp4(path, frames, fps):
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            raise RuntimeError(f'Cannot write {path} because ffmpeg is not on the PATH (write a .gif instead)')
+
+        process = None
+        for frame in frames:
+            # ffmpeg starts with the first frame, which gives the size of the video
+            if process is None:
+                height, width = frame.shape[:2]
+                process = subprocess.Popen([
+                    ffmpeg, '-y', '-loglevel', 'error',
+                    '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+                    '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', path,
+                ], stdin=subprocess.PIPE)
+            process.stdin.write(frame.tobytes())
+        if process is not None:
+            process.stdin.close()
+            if process.wait() != 0:
+                raise RuntimeError(f'ffmpeg failed to write {path}')
+
+    def export_file(file_name, output_directory, extension='.gif', dataset_path=None):
+        '''Writes the video of one scene into output_directory, returns a json-able result (with the error if it fails)'''
+        start = time.perf_counter()
+        path = os.path.join(output_directory, os.path.splitext(file_name)[0] + extension)
+        result = {'file_name': file_name, 'path': path}
+        try:
+            SceneVideo(Scene.from_data(Data(file_name, dataset_path)), cache=FeatureCache.shared(dataset_path)).save(path)
+        except Exception as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        result['seconds'] = time.perf_counter() - start
+        return result
+
+    def export_files(file_names, output_directory, extension='.gif', workers=None, dataset_path=None):
+        '''Writes the videos of many scenes in parallel, yields the result of each one as it finishes'''
+        os.makedirs(output_directory, exist_ok=True)
+        export = functools.partial(SceneVideo.export_file, output_directory=output_directory, extension=extension, dataset_path=dataset_path)
+        workers = workers or os.cpu_count() or 1
+
+        # a single worker runs in this process, which is easier to debug
+        if workers == 1:
+            yield from map(export, file_names)
+            return
+        with multiprocessing.Pool(workers) as pool:
+            yield from pool.imap_unordered(export, file_names)
+
+    def __str__(self):
+        return f'SceneVideo({len(self.tis)} frames)'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m neatcrat.video', description='Exports scene videos without a window')
+    parser.add_argument('output_directory', help='directory the videos are written into')
+    parser.add_argument('file_names', nargs='*', help='scenes to export (all of them by default)')
+    parser.add_argument('--format', default='gif', choices=['gif', 'mp4'], help='video format (mp4 needs ffmpeg)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes (all cpus by default)')
+    parser.add_argument('--dataset', default='.', help='path that holds the dataset directory')
+    args = parser.parse_args()
+
+    file_names = sorted(args.file_names or Data.file_names(args.dataset)[2])
+    errors = 0
+    for result in SceneVideo.export_files(file_names, args.output_directory, f'.{args.format}', args.workers, args.dataset):
+        if 'error' in result:
+            errors += 1
+            print(f'{result["file_name"]}: {result["error"]}', file=sys.stderr)
+    print(f'{len(file_names) - errors}/{len(file_names)} videos written into {args.output_directory}', file=sys.stderr)
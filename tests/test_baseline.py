@@ -0,0 +1,160 @@
+'''
+Front agents and labels of a few scenes against the behaviour of the baseline, and the view semantics of AgentTable
+
+The expected values were made by the baseline implementation (one Agent object per row, a front search per frame),
+written as runs of (value, number of frames)
+'''
+
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+from neatcrat.agent import Agent, AgentTable
+from neatcrat.agentfinder import AgentFinder
+from neatcrat.classifier import SceneClassifier
+from neatcrat.constants import SCENE_LENGTH
+from neatcrat.data import Data
+from neatcrat.scene import Scene
+from neatcrat.stream import StreamingClassifier
+
+DATASET_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BASELINE = {
+    '0.csv': {
+        'labels': [('1.1.2 LeadVehicleCutOut', 3), ('1.1.6 LeadVehicleAccelerating', 8), ('1.1.3 VehicleCutInAhead', 12), ('9.9.9 Invalid', 2), ('1.1.3 VehicleCutInAhead', 6), ('9.9.9 Invalid', 9)],
+        'front': [('scene-000000-62', 1), ('scene-000000-63', 12), ('scene-000000-61', 4), (None, 2), ('scene-000000-1', 4), (None, 4), ('scene-000000-1', 2), (None, 6), ('scene-000000-8', 4), ('scene-000000-4', 1)],
+        'turning': [(None, 40)],
+    },
+    '20.csv': {
+        'labels': [('2.4.2 WithLeadVehicle', 5), ('1.1.1 LeadVehicleConstant', 1), ('1.1.5 LeadVehicleStppoed', 2), ('1.1.1 LeadVehicleConstant', 8), ('1.1.3 VehicleCutInAhead', 5), ('1.1.2 LeadVehicleCutOut', 4), ('1.1.5 LeadVehicleStppoed', 11), ('9.9.9 Invalid', 4)],
+        'front': [('scene-000020-5', 18), ('scene-000020-1', 5), ('scene-000020-5', 2), ('scene-000020-6', 15)],
+        'turning': [('scene-000020-5', 12), (None, 6), ('scene-000020-1', 5), (None, 17)],
+    },
+    '25.csv': {
+        'labels': [('1.1.6 LeadVehicleAccelerating', 5), ('1.1.2 LeadVehicleCutOut', 4), ('1.1.3 VehicleCutInAhead', 4), ('2.4.3 VehiclesCrossing', 5), ('2.4.1 NoVehiclesAhead', 8), ('2.4.3 VehiclesCrossing', 3), ('2.4.2 WithLeadVehicle', 2), ('1.1.6 LeadVehicleAccelerating', 3), ('1.1.1 LeadVehicleConstant', 5), ('1.1.6 LeadVehicleAccelerating', 1)],
+        'front': [('scene-000025-1', 7), ('scene-000025-17', 4), ('scene-000025-8', 4), ('scene-000025-6', 13), ('scene-000025-225', 12)],
+        'turning': [('scene-000025-1', 7), (None, 8), ('scene-000025-6', 2), (None, 11), ('scene-000025-225', 9), (None, 3)],
+    },
+}
+
+def expand(runs):
+    return list(itertools.chain.from_iterable([value] * count for value, count in runs))
+
+def scene(file_name):
+    return Scene.from_data(Data(file_name, DATASET_PATH))
+
+''' scenes '''
+
+@pytest.mark.parametrize('file_name', sorted(BASELINE))
+def test_get_front(file_name):
+    finder = AgentFinder(scene(file_name))
+    fronts = [finder.get_front(ti) for ti in range(SCENE_LENGTH)]
+    assert [None if front is None else front.id for front in fronts] == expand(BASELINE[file_name]['front'])
+
+@pytest.mark.parametrize('file_name', sorted(BASELINE))
+def test_get_turning_front(file_name):
+    finder = AgentFinder(scene(file_name))
+    fronts = [finder.get_turning_front(ti) for ti in range(SCENE_LENGTH)]
+    assert [None if front is None else front.id for front in fronts] == expand(BASELINE[file_name]['turning'])
+
+@pytest.mark.parametrize('file_name', sorted(BASELINE))
+def test_front_track(file_name):
+    finder = AgentFinder(scene(file_name))
+    slots, distances = finder.front_track()
+    ids = finder.scene.table.ids
+    assert [None if slot < 0 else ids[slot] for slot in slots.tolist()] == expand(BASELINE[file_name]['front'])
+    assert np.array_equal(np.isnan(distances), slots < 0)
+
+@pytest.mark.parametrize('file_name', sorted(BASELINE))
+def test_classify_scene(file_name):
+    assert SceneClassifier(scene(file_name)).classify_scene() == expand(BASELINE[file_name]['labels'])
+
+@pytest.mark.parametrize('file_name', sorted(BASELINE))
+def test_streaming_parity(file_name):
+    data = Data(file_name, DATASET_PATH)
+    labels = StreamingClassifier.classify_frames(data.frames(), list(data.labels['second_class']), lookahead=SCENE_LENGTH - 1)
+    assert labels == expand(BASELINE[file_name]['labels'])
+
+@pytest.mark.parametrize('file_name', sorted(BASELINE))
+def test_streaming_provisional_labels(file_name):
+    data = Data(file_name, DATASET_PATH)
+    classifier = StreamingClassifier()
+    labels = {}
+    for ti, (frame, second_class) in enumerate(zip(data.frames(), data.labels['second_class'])):
+        labels.update(classifier.push(frame, second_class))
+        # every frame is labelled by the push it arrives with
+        assert ti in labels
+    assert len(set(labels.values())) > 1
+
+    labels.update(classifier.finish())
+    assert [labels[ti] for ti in range(SCENE_LENGTH)] == StreamingClassifier.classify_frames(data.frames(), list(data.labels['second_class']))
+
+''' agent table '''
+
+def table():
+    # two slots over three frames, the second slot misses frame 1
+    table = AgentTable(['scene-000001-1', 'scene-000001-2'], ['Vehicle', 'Pedestrian'], 3)
+    for ti in range(3):
+        table.set(0, ti, ti, 2 * ti, 1, 2, 0, 0, 90, 0, False)
+    for ti in [0, 2]:
+        table.set(1, ti, 10 + ti, 0, 1, 0, 0, 0, 0, 0, False)
+    return table
+
+def test_view_reads_and_writes_the_table():
+    agents = table()
+    agent = Agent.view(agents, 0, 2)
+    assert (agent.id, agent.type, agent.code) == ('scene-000001-1', 'Vehicle', '1')
+    assert (agent.x, agent.y) == (2, 4)
+
+    agent.x = 7
+    assert agents.x[0, 2] == 7
+    agents.y[0, 2] = 8
+    assert agent.y == 8
+
+def test_standalone_agent_and_copy():
+    agent = Agent('scene-000001-3', 'Vehicle', 3, 4, 0, 0, 0, 0, 90, 0, True)
+    assert len(agent.table) == 1 and agent.implied
+    assert agent.r == pytest.approx(5)
+
+    copy = agent.copy()
+    copy.x = 0
+    assert agent.x == 3 and copy.table is not agent.table
+
+def test_polar_fields_follow_set():
+    agents = table()
+    agent = Agent.view(agents, 0, 1)
+    assert agent.r == pytest.approx(np.sqrt(5))
+    agents.set(0, 1, 3, 4, 0, 0, 0, 0, 90, 0, False)
+    assert agent.r == pytest.approx(5)
+
+def test_taken_and_resized_copy():
+    agents = table()
+    taken = agents.taken([1])
+    assert taken.ids == ['scene-000001-2'] and taken.valid[0].tolist() == [True, False, True]
+    taken.x[0, 0] = -1
+    assert agents.x[1, 0] == 10
+
+    longer = agents.resized(5)
+    assert longer.valid.shape == (2, 5) and not longer.valid[:, 3:].any()
+    shorter = agents.resized(2)
+    assert np.array_equal(shorter.x, agents.x[:, :2])
+    shorter.x[0, 0] = -1
+    assert agents.x[0, 0] == 0
+
+def test_interpolate_gaps():
+    agents = table()
+    agents.update_polar()
+    assert agents.slots_at(1).tolist() == [0]
+
+    assert agents.interpolate_gaps([0]) == 0
+    assert agents.interpolate_gaps() == 1
+    assert agents.valid[1, 1] and agents.implied[1, 1]
+    assert agents.x[1, 1] == pytest.approx(11)
+    assert agents.slots_at(1).tolist() == [0]
+    assert agents.slots_at(1, include_implied=True).tolist() == [0, 1]
+
+    # polar fields of the filled row are updated
+    assert agents.r[1, 1] == pytest.approx(11)
+    assert agents.interpolate_gaps() == 0